@@ -1,23 +1,48 @@
 import json
+import logging
 import os
-from typing import Any, Deque, Dict, List
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from types import SimpleNamespace
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional
 import uuid
 import asyncio
-from agent_utils import DISPATCH, TOOLS
-import openai
-from dotenv import load_dotenv
+import time
+from agent_utils import DISPATCH, TOOLS, api_key, get_client
+from context_budget import compact_history, compact_tool_results, digest_tool_output
+from metrics import bind_context, record_usage, stage, stage_errors
+
+logger = logging.getLogger("tailord.agent")
 
 # ----- CONFIG -----
-load_dotenv()
-api_key = os.getenv('OPENAI_KEY')
-client = openai.OpenAI(api_key=api_key)
+# AsyncOpenAI is created lazily, like agent_utils.get_client
+async_client = None
+
+def get_async_client():
+    global async_client
+    if async_client is None:
+        import openai
+        async_client = openai.AsyncOpenAI(api_key=api_key)
+    return async_client
+
+# Tools do blocking work (SentenceTransformer encode, Milvus search, nested LLM
+# calls). The async loop hands them to this bounded pool so the event loop
+# stays free and a burst of turns cannot spawn unbounded threads.
+TOOL_WORKERS = int(os.getenv("TOOL_WORKERS", "8"))
+tool_executor = ThreadPoolExecutor(max_workers=TOOL_WORKERS, thread_name_prefix="tool")
+TOOL_TIMEOUT_SECONDS = float(os.getenv("TOOL_TIMEOUT_SECONDS", "30"))
+
+def _ctx_get(ctx, key: str):
+    # ctx may be a UserContext-like object or a plain dict (per-session ctx in fastapi_app)
+    if isinstance(ctx, dict):
+        return ctx.get(key)
+    return getattr(ctx, key, None)
 
 def _context_system_text(ctx) -> str:
     parts = []
-    if getattr(ctx, "age", None) is not None:
-        parts.append(f"age={ctx.age}")
-    if getattr(ctx, "gender", None) is not None:
-        parts.append(f"gender={ctx.gender}")
+    if _ctx_get(ctx, "age") is not None:
+        parts.append(f"age={_ctx_get(ctx, 'age')}")
+    if _ctx_get(ctx, "gender") is not None:
+        parts.append(f"gender={_ctx_get(ctx, 'gender')}")
     profile = "; ".join(parts) if parts else "none provided"
     return (
         "User profile context: "
@@ -25,6 +50,116 @@ def _context_system_text(ctx) -> str:
         "Do not infer attributes, stereotype, or ask for unnecessary details."
     )
 
+def _build_working(messages, base_system_prompt: str, ctx) -> List[Dict[str, Any]]:
+    # Build working transcript seen by the model this turn; history is cut
+    # to its token budget, older turns folded into a summary
+    return [
+        {"role": "system", "content": base_system_prompt},
+        {"role": "system", "content": _context_system_text(ctx)},
+        *compact_history(messages),
+    ]
+
+
+def _assistant_tool_request(msg, tool_calls) -> Dict[str, Any]:
+    # Record assistant request (with tool_calls) in the working transcript
+    return {
+        "role": "assistant",
+        "content": msg.content or None,
+        "tool_calls": [tc.model_dump() for tc in tool_calls],
+    }
+
+
+def _run_tool(name: str, raw_args: str) -> Any:
+    logger.info("tool %s %s", name, raw_args)
+    try:
+        args = json.loads(raw_args or "{}")
+    except json.JSONDecodeError:
+        args = {}
+
+    fn = DISPATCH.get(name)
+    if not fn:
+        stage_errors.inc(stage="tool", detail=name)
+        return {"error": f"unknown_tool:{name}", "args": args}
+    with stage("tool", name):
+        try:
+            return fn(**args)  # <- if tools need ctx, see notes below
+        except Exception as e:
+            stage_errors.inc(stage="tool", detail=name)
+            logger.warning("tool %s failed: %s", name, e)
+            return {"error": str(e), "args": args}
+
+
+def _tool_timeout_output(tc, timeout: float) -> Dict[str, Any]:
+    # the worker thread cannot be interrupted; its late result is simply dropped
+    stage_errors.inc(stage="tool_timeout", detail=tc.function.name)
+    logger.warning("tool %s timed out after %gs", tc.function.name, timeout)
+    return {"error": f"timeout:{tc.function.name} exceeded {timeout:g}s", "args": tc.function.arguments}
+
+
+def _run_tool_batch(tool_calls, timeout: float = TOOL_TIMEOUT_SECONDS) -> List[Any]:
+    """
+    Run every tool call of one model response concurrently on tool_executor.
+    Outputs come back in the same order as `tool_calls`; each call gets its
+    own timeout, and failures are captured per call.
+    """
+    deadline = time.monotonic() + timeout
+    futures = [
+        tool_executor.submit(bind_context(_run_tool, tc.function.name, tc.function.arguments))
+        for tc in tool_calls
+    ]
+    outputs = []
+    for tc, fut in zip(tool_calls, futures):
+        try:
+            # calls run side by side, so they share one deadline from submission
+            outputs.append(fut.result(timeout=max(0.0, deadline - time.monotonic())))
+        except FutureTimeout:
+            fut.cancel()
+            outputs.append(_tool_timeout_output(tc, timeout))
+        except Exception as e:
+            outputs.append({"error": str(e), "args": tc.function.arguments})
+    return outputs
+
+
+async def _run_tool_batch_async(tool_calls, timeout: float = TOOL_TIMEOUT_SECONDS) -> List[Any]:
+    loop = asyncio.get_running_loop()
+
+    async def one(tc):
+        try:
+            return await asyncio.wait_for(
+                loop.run_in_executor(tool_executor, bind_context(_run_tool, tc.function.name, tc.function.arguments)),
+                timeout=timeout,
+            )
+        except asyncio.TimeoutError:
+            return _tool_timeout_output(tc, timeout)
+        except Exception as e:
+            return {"error": str(e), "args": tc.function.arguments}
+
+    # gather preserves argument order, so outputs line up with tool_call_ids
+    return await asyncio.gather(*(one(tc) for tc in tool_calls))
+
+
+def _tool_message(tc, tool_output: Any) -> Dict[str, Any]:
+    return {
+        "role": "tool",
+        "tool_call_id": tc.id,
+        "name": tc.function.name,
+        "content": json.dumps(tool_output, ensure_ascii=False),
+    }
+
+
+def _record_tool_results(working: List[Dict[str, Any]], tool_calls, outputs,
+                         shown: Optional[List[str]]) -> None:
+    # called right after the assistant tool request was appended
+    batch_start = len(working) - 1
+    for tc, tool_output in zip(tool_calls, outputs):
+        working.append(_tool_message(tc, tool_output))
+        digest = digest_tool_output(tool_output)
+        if digest and shown is not None and digest not in shown:
+            shown.append(digest)
+    # earlier iterations' results shrink to digests once over budget
+    compact_tool_results(working, keep_from=batch_start)
+
+
 # ----- INIT -----
 def run_agent_turn(
     messages: Deque[Dict[str, Any]],   # persistent history: user/assistant only
@@ -32,58 +167,29 @@ def run_agent_turn(
     ctx,                               # UserContext (with age/gender)
     model: str = "gpt-4o",
     max_tool_iterations: int = 4,
+    shown: Optional[List[str]] = None,  # collects digests of products returned by tools
 ) -> str:
-   
-    # Build working transcript seen by the model this turn
-    working: List[Dict[str, Any]] = [
-        {"role": "system", "content": base_system_prompt},
-        {"role": "system", "content": _context_system_text(ctx)},
-        *list(messages),
-    ]
+
+    working = _build_working(messages, base_system_prompt, ctx)
 
     for _ in range(max_tool_iterations + 1):
-        resp = client.chat.completions.create(
-            model=model,
-            messages=working,
-            tools=TOOLS,
-            tool_choice="auto",
-        )
+        with stage("llm", model):
+            resp = get_client().chat.completions.create(
+                model=model,
+                messages=working,
+                tools=TOOLS,
+                tool_choice="auto",
+            )
+        record_usage(model, getattr(resp, "usage", None))
         msg = resp.choices[0].message
         tool_calls = getattr(msg, "tool_calls", None)
 
         if tool_calls:
-            # Record assistant request (with tool_calls) in the working transcript
-            working.append({
-                "role": "assistant",
-                "content": msg.content or None,
-                "tool_calls": [tc.model_dump() for tc in tool_calls],
-            })
-
-            # Execute tools and append outputs to the working transcript
-            for tc in tool_calls:
-                name = tc.function.name
-                raw_args = tc.function.arguments or "{}"
-                print(name, raw_args)
-                try:
-                    args = json.loads(raw_args)
-                except json.JSONDecodeError:
-                    args = {}
-
-                fn = DISPATCH.get(name)
-                if not fn:
-                    tool_output = {"error": f"unknown_tool:{name}", "args": args}
-                else:
-                    try:
-                        tool_output = fn(**args)  # <- if tools need ctx, see notes below
-                    except Exception as e:
-                        tool_output = {"error": str(e), "args": args}
-
-                working.append({
-                    "role": "tool",
-                    "tool_call_id": tc.id,
-                    "name": name,
-                    "content": json.dumps(tool_output, ensure_ascii=False),
-                })
+            working.append(_assistant_tool_request(msg, tool_calls))
+
+            # Execute tools concurrently; append outputs in tool_call order
+            outputs = _run_tool_batch(tool_calls)
+            _record_tool_results(working, tool_calls, outputs, shown)
             continue
 
         # Final assistant message → persist to your real history and return
@@ -96,5 +202,155 @@ def run_agent_turn(
     return fallback
 
 
+async def run_agent_turn_async(
+    messages: Deque[Dict[str, Any]],
+    base_system_prompt: str,
+    ctx,
+    model: str = "gpt-4o",
+    max_tool_iterations: int = 4,
+    llm_client=None,
+    shown: Optional[List[str]] = None,
+) -> str:
+    """
+    Same loop as run_agent_turn, but awaits an AsyncOpenAI client and runs the
+    blocking tool functions on `tool_executor`. Many turns can be in flight on
+    one event loop; only tool execution occupies a worker thread.
+
+    `llm_client` defaults to the module-level AsyncOpenAI client; any object
+    exposing an async `chat.completions.create` works.
+    """
+    llm_client = llm_client or get_async_client()
+    working = _build_working(messages, base_system_prompt, ctx)
+
+    for _ in range(max_tool_iterations + 1):
+        with stage("llm", model):
+            resp = await llm_client.chat.completions.create(
+                model=model,
+                messages=working,
+                tools=TOOLS,
+                tool_choice="auto",
+            )
+        record_usage(model, getattr(resp, "usage", None))
+        msg = resp.choices[0].message
+        tool_calls = getattr(msg, "tool_calls", None)
+
+        if tool_calls:
+            working.append(_assistant_tool_request(msg, tool_calls))
+
+            outputs = await _run_tool_batch_async(tool_calls)
+            _record_tool_results(working, tool_calls, outputs, shown)
+            continue
+
+        return msg.content or ""
+
+    return "I hit a tool-call loop limit—try rephrasing or /reset."
+
+
+# ----- STREAMING -----
+# user-facing progress labels for the SSE stream
+TOOL_PROGRESS = {
+    "find_products_tool": "searching catalog",
+    "glossary_lookup_tool": "looking up vibe",
+    "query_to_search_str_tool": "building search query",
+    "catalog_search_tool": "searching catalog",
+}
+
 
+class _StreamedToolCall:
+    """Tool call reassembled from streamed deltas; quacks like the SDK object."""
 
+    def __init__(self):
+        self.id = ""
+        self.function = SimpleNamespace(name="", arguments="")
+
+    def model_dump(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "type": "function",
+            "function": {"name": self.function.name, "arguments": self.function.arguments},
+        }
+
+
+async def stream_agent_turn(
+    messages: Deque[Dict[str, Any]],
+    base_system_prompt: str,
+    ctx,
+    model: str = "gpt-4o",
+    max_tool_iterations: int = 4,
+    llm_client=None,
+    shown: Optional[List[str]] = None,
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Streaming variant of run_agent_turn_async. Yields events as they happen:
+
+        {"type": "progress", "tool": name, "message": "searching catalog"}
+        {"type": "token", "text": "..."}      # reply tokens
+        {"type": "done", "reply": "..."}      # full reply, always last
+
+    Text the model writes before a tool call ("Let me check.") is streamed
+    as it arrives, so it is part of the reply: `done` carries every token
+    sent, and that is what ends up in the history.
+    """
+    llm_client = llm_client or get_async_client()
+    working = _build_working(messages, base_system_prompt, ctx)
+    streamed: List[str] = []  # every token sent this turn, across iterations
+
+    for _ in range(max_tool_iterations + 1):
+        content_parts: List[str] = []
+        calls: Dict[int, _StreamedToolCall] = {}
+
+        # timed until the stream is drained (includes the caller consuming tokens)
+        with stage("llm_stream", model):
+            stream = await llm_client.chat.completions.create(
+                model=model,
+                messages=working,
+                tools=TOOLS,
+                tool_choice="auto",
+                stream=True,
+                stream_options={"include_usage": True},
+            )
+            async for chunk in stream:
+                # the usage chunk comes last, with no choices
+                record_usage(model, getattr(chunk, "usage", None))
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                if delta.content:
+                    if not content_parts and streamed and not streamed[-1][-1:].isspace():
+                        # keep a preamble and the next iteration's text apart
+                        streamed.append("\n\n")
+                        yield {"type": "token", "text": "\n\n"}
+                    content_parts.append(delta.content)
+                    streamed.append(delta.content)
+                    yield {"type": "token", "text": delta.content}
+                for d in delta.tool_calls or []:
+                    tc = calls.setdefault(d.index, _StreamedToolCall())
+                    if d.id:
+                        tc.id = d.id
+                    if d.function and d.function.name:
+                        tc.function.name += d.function.name
+                    if d.function and d.function.arguments:
+                        tc.function.arguments += d.function.arguments
+
+        content = "".join(content_parts)
+        if calls:
+            tool_calls = [calls[i] for i in sorted(calls)]
+            working.append(_assistant_tool_request(SimpleNamespace(content=content), tool_calls))
+            for tc in tool_calls:
+                yield {
+                    "type": "progress",
+                    "tool": tc.function.name,
+                    "message": TOOL_PROGRESS.get(tc.function.name, tc.function.name),
+                }
+            outputs = await _run_tool_batch_async(tool_calls)
+            _record_tool_results(working, tool_calls, outputs, shown)
+            continue
+
+        yield {"type": "done", "reply": "".join(streamed)}
+        return
+
+    fallback = "I hit a tool-call loop limit—try rephrasing or /reset."
+    if streamed:
+        fallback = "\n\n" + fallback
+    yield {"type": "token", "text": fallback}
+    yield {"type": "done", "reply": "".join(streamed) + fallback}
@@ -1,16 +1,33 @@
 import json
-from typing import Any, Dict, List, Optional
-from agents import Agent, Runner, ModelSettings, SQLiteSession
-from agents.tool import function_tool, ToolContext
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
 from db_upload import search_catalog
-from glossary_service import search_glossary
-import openai
+from glossary_service import match_glossary, search_glossary
+from expansion_cache import expansion_key, get_store as get_expansion_store
+from facet_extractor import extract_facets, parse_price_range
+from metrics import REGISTRY, bind_context, record_usage, stage
 import os
 from dotenv import load_dotenv
 
 load_dotenv()
 api_key = os.getenv('OPENAI_KEY')
-client = openai.OpenAI(api_key=api_key)
+logger = logging.getLogger("tailord.agent_utils")
+
+# openai is imported and the client built on first use; the SDK alone costs
+# most of a second at import time
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                import openai
+                _client = openai.OpenAI(api_key=api_key)
+    return _client
 
 def json_to_str(query: Dict[str, Any]) -> str:
     parts: list[str] = []
@@ -42,6 +59,32 @@ def json_to_str(query: Dict[str, Any]) -> str:
 
     return " ".join(parts)
 
+def split_filters(query: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Move the constraints search_catalog can filter on (a parseable price,
+    sizes) out of an expanded query, so they are not embedded as text.
+    Returns (query without those keys, search_catalog filter kwargs).
+    """
+    rest = dict(query)
+    filters: Dict[str, Any] = {}
+    lo, hi = parse_price_range(rest.get("price"))
+    if lo is not None or hi is not None:
+        rest.pop("price")
+        if lo is not None:
+            filters["price_min"] = lo
+        if hi is not None:
+            filters["price_max"] = hi
+    # the expansion is LLM output: sizes may be a bare value or a mixed list
+    sizes = rest.pop("sizes", None)
+    sizes = [str(s) for s in (sizes if isinstance(sizes, (list, tuple)) else [sizes]) if s not in (None, "")]
+    if sizes:
+        filters["sizes"] = sizes
+    return rest, filters
+
+EXPAND_MODEL = "gpt-5-nano"
+# bump whenever the system prompt below changes; cached expansions are keyed on it
+EXPAND_PROMPT_VERSION = 1
+
 def llm_expand_query(user_query: str, vibe_info: str) -> dict:
     """
     Use an LLM to translate a user query and optional vibe_info into
@@ -49,7 +92,15 @@ def llm_expand_query(user_query: str, vibe_info: str) -> dict:
     fields that are relevant; omit unknowns.
     
     Possible fields: item, price, materials, sizes, vibe_definition, cuts, colors, details, occasion, season.
+
+    Parsed expansions are cached on disk (expansion_cache), so a repeated
+    (query, vibe_info) pair skips the LLM call.
     """
+    store = get_expansion_store()
+    key = expansion_key(EXPAND_MODEL, EXPAND_PROMPT_VERSION, user_query, vibe_info)
+    cached = store.get(key)
+    if cached is not None:
+        return cached
 
     system_prompt = """You are a fashion search query generator.
                     Convert the user query and vibe definition into a structured JSON object
@@ -73,40 +124,75 @@ def llm_expand_query(user_query: str, vibe_info: str) -> dict:
 
     user_prompt = f"""User query: {user_query} Vibe definition: {vibe_info}"""
 
-    resp = client.chat.completions.create(
-        model="gpt-5-nano",  # or whichever model you're using
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt},
-        ],
-        response_format={"type": "json_object"},
-        max_completion_tokens=5000
-    )
+    with stage("llm_expand", EXPAND_MODEL):
+        resp = get_client().chat.completions.create(
+            model=EXPAND_MODEL,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt},
+            ],
+            response_format={"type": "json_object"},
+            max_completion_tokens=5000
+        )
+    record_usage(EXPAND_MODEL, getattr(resp, "usage", None))
     raw = resp.choices[0].message.content
 
     try:
         parsed = json.loads(raw)
     except json.JSONDecodeError:
-        # fallback: return empty dict if LLM outputs non-JSON
-        parsed = {}
+        # fallback: return empty dict if LLM outputs non-JSON (not cached)
+        logger.warning("llm_expand_query returned non-JSON output")
+        return {}
 
+    if isinstance(parsed, dict):
+        store.put(key, parsed)
     return parsed
 
 
+# rule-based expansions at or above this confidence skip the LLM
+FAST_EXPAND_MIN_CONFIDENCE = float(os.getenv("FAST_EXPAND_MIN_CONFIDENCE", "0.8"))
+expansion_stats = {"rules": 0, "llm": 0}
+REGISTRY.register_collector(lambda: [(
+    "tailord_query_expansions_total", "counter", "Query expansions by path (rules or llm)",
+    [({"path": path}, n) for path, n in expansion_stats.items()],
+)])
+
+def expand_query(user_query: str, vibe_info: Any) -> dict:
+    """
+    Structured expansion of a user query: the in-process facet extractor
+    when it is confident, llm_expand_query otherwise.
+    """
+    with stage("rule_expand"):
+        facets, confidence = extract_facets(user_query, vibe_info)
+    logger.debug("rule expansion confidence %.2f for %r", confidence, user_query)
+    if confidence >= FAST_EXPAND_MIN_CONFIDENCE:
+        expansion_stats["rules"] += 1
+        return facets
+    expansion_stats["llm"] += 1
+    return llm_expand_query(user_query, vibe_info)
+
 
 TOOLS = [
     {
         "type": "function",
         "function": {
-            "name": "catalog_search_tool",
-            "description": "Search the fashion catalog with structured filters and return top matches.",
+            "name": "find_products_tool",
+            "description": (
+                "Find catalog products for a shopping request in one step: resolves vibe/slang terms in the "
+                "glossary, builds the structured search and returns compact products plus the vibe definitions used."
+            ),
             "parameters": {
                 "type": "object",
                 "properties": {
-                    "query": {"type": "string", "description": "Normalized query with optional fields; string formatted from JSON", "additionalProperties": False},
-                    "top_k": {"type": "integer", "default": 5},    
+                    "query": {"type": "string", "description": "The user's request in their own words"},
+                    "vibe_terms": {"type": "array", "items": {"type": "string"}, "description": "Vibe or slang phrases from the request, e.g. ['goth', 'y2k']"},
+                    "top_k": {"type": "integer", "default": 5},
+                    "price_min": {"type": "number", "description": "Lowest acceptable price"},
+                    "price_max": {"type": "number", "description": "Highest acceptable price"},
+                    "product_types": {"type": "array", "items": {"type": "string"}, "description": "Restrict to these product types, e.g. ['Jeans']"},
+                    "sizes": {"type": "array", "items": {"type": "string"}, "description": "Only products in stock in any of these sizes"},
                 },
-                "required": ["item"],
+                "required": ["query"],
                 "additionalProperties": False
             },
         },
@@ -126,49 +212,123 @@ TOOLS = [
             },
         },
     },
-    {
-        "type": "function",
-        "function": {
-            "name": "query_to_search_str_tool",
-            "description": "Turn a freeform user query into a compact catalog search string.",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "query": {"type": "string", "description": "Raw user query"},
-                    "vibe_info": {"type": "array", "items": {"type": "string"}, "description": "List of vibe info strings"},
-                },
-                "required": ["user_query"],
-                "additionalProperties": False
-            },
-        },
-    },
 ]
 
 
 
 def _catalog_search_tool(*, query: str,
-                         top_k: int = 10) -> Dict[str, Any]:
+                         top_k: int = 10,
+                         price_min: Optional[float] = None,
+                         price_max: Optional[float] = None,
+                         product_types: Optional[List[str]] = None,
+                         sizes: Optional[List[str]] = None) -> Dict[str, Any]:
    
-    hits = search_catalog(query, top_k)
+    hits = search_catalog(query, top_k, price_min=price_min, price_max=price_max,
+                          product_types=product_types, sizes=sizes)
     return hits
 
 
 def _glossary_lookup_tool(*, term: str) -> Dict[str, Any]:
+    # names/aliases resolve in-process; vector search only for free-form descriptions
+    hit = match_glossary(term)
+    if hit:
+        return [hit["text"]]
+
     vibe_info = []
-    glossary_lookup = search_glossary(term)[0]
-    if glossary_lookup['score'] > 0.5:
-        vibe_info = [glossary_lookup['text']]
+    matches = search_glossary(term)
+    if matches and matches[0]['score'] > 0.5:
+        vibe_info = [matches[0]['text']]
     return vibe_info
 
 
 def _query_to_search_str_tool(*, query: str, vibe_info: List[str]) -> Dict[str, Any]:
-    json_search_obj = llm_expand_query(query, vibe_info)
-    print(json_search_obj)
+    json_search_obj = expand_query(query, vibe_info)
+    logger.debug("expanded query: %s", json_search_obj)
+    json_search_obj, filters = split_filters(json_search_obj)
     str_search_obj = json_to_str(json_search_obj)
-    return str_search_obj
+    return {"query": str_search_obj, "filters": filters}
+
+
+# glossary lookups are independent of each other; run several at once
+_lookup_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="glossary-lookup")
+
+def lookup_vibes(terms: List[str]) -> List[str]:
+    """vibe_info texts for `terms`, de-duplicated, in term order."""
+    terms = [t for t in dict.fromkeys(terms) if t]
+    with stage("glossary_lookup"):
+        if len(terms) > 1:
+            futures = [_lookup_executor.submit(bind_context(_glossary_lookup_tool, term=t)) for t in terms]
+            results = [f.result() for f in futures]
+        else:
+            results = [_glossary_lookup_tool(term=t) for t in terms]
+    vibe_info: List[str] = []
+    for texts in results:
+        for text in texts:
+            if text not in vibe_info:
+                vibe_info.append(text)
+    return vibe_info
+
+
+def search_pipeline(query: str,
+                    vibe_terms: Optional[List[str]] = None,
+                    top_k: int = 10,
+                    only_in_stock: bool = True,
+                    filters: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    The glossary -> expansion -> catalog sequence the chat agent is prompted
+    to follow, run directly with no orchestrating model in between.
+    `vibe_terms` defaults to the raw query itself. Explicit `filters`
+    (search_catalog kwargs) override those parsed from the query.
+    """
+    vibe_info = lookup_vibes(vibe_terms or [query])
+
+    expanded, parsed_filters = split_filters(expand_query(query, vibe_info))
+    filters = {**parsed_filters, **{k: v for k, v in (filters or {}).items() if v is not None}}
+    search_str = json_to_str(expanded) or query
+    hits = search_catalog(search_str, top_k, only_in_stock=only_in_stock, **filters)
+    return {
+        "query": query,
+        "vibe_info": vibe_info,
+        "search_str": search_str,
+        "filters": filters,
+        "results": hits,
+    }
+
+
+def compact_hit(hit: Dict[str, Any]) -> Dict[str, Any]:
+    # what the model needs to recommend and cite; scores and flags stay out of the context
+    out = {"id": hit["id"], "title": hit["title"], "product_type": hit["product_type"]}
+    if hit.get("price_min") is not None:
+        out["price"] = hit["price_min"] if hit.get("price_max") in (None, hit["price_min"]) \
+            else f"{hit['price_min']}-{hit['price_max']}"
+    if hit.get("sizes_in_stock"):
+        out["sizes"] = hit["sizes_in_stock"]
+    out["handle"] = hit["handle"]
+    return out
+
+
+def _find_products_tool(*, query: str,
+                        vibe_terms: Optional[List[str]] = None,
+                        top_k: int = 5,
+                        price_min: Optional[float] = None,
+                        price_max: Optional[float] = None,
+                        product_types: Optional[List[str]] = None,
+                        sizes: Optional[List[str]] = None) -> Dict[str, Any]:
+    result = search_pipeline(query, vibe_terms=vibe_terms, top_k=top_k,
+                             filters={"price_min": price_min, "price_max": price_max,
+                                      "product_types": product_types, "sizes": sizes})
+    return {
+        "vibe_info": result["vibe_info"],
+        "search": result["search_str"],
+        "filters": result["filters"],
+        "products": [compact_hit(h) for h in result["results"]],
+    }
 
 
+# catalog_search_tool / query_to_search_str_tool are no longer offered to the
+# model (find_products_tool does both), but stay callable for older histories
 DISPATCH = {
+    "find_products_tool": _find_products_tool,
     "catalog_search_tool": _catalog_search_tool,
     "glossary_lookup_tool": _glossary_lookup_tool,
     "query_to_search_str_tool": _query_to_search_str_tool,
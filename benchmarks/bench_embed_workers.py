@@ -0,0 +1,74 @@
+"""
+Throughput of db_upload.EmbedPool vs. worker count on real catalog texts.
+
+    python benchmarks/bench_embed_workers.py --texts 5000 --workers 1 2 4 8
+
+Texts are the transform_product search_text of products.json, repeated up to
+--texts. Pool start-up (process spawn + model load) is timed separately from
+encoding. Every run is checked against the single-process vectors.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np  # noqa: E402
+
+import db_upload  # noqa: E402
+
+
+def catalog_texts(n: int) -> list:
+    with open(os.path.join(ROOT, "products.json"), "r", encoding="utf-8") as f:
+        products = json.load(f)
+    base = [db_upload.transform_product(p)["search_text"] for p in products]
+    # suffix repeats so every text is distinct work for the model
+    return [f"{base[i % len(base)]} #{i // len(base)}" for i in range(n)]
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--texts", type=int, default=2000)
+    ap.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    ap.add_argument("--chunk-size", type=int, default=db_upload.EMBED_CHUNK_SIZE)
+    ap.add_argument("--out", default=None, help="optional JSON results file")
+    args = ap.parse_args()
+
+    texts = catalog_texts(args.texts)
+    reference = None
+    rows = []
+    for workers in args.workers:
+        t0 = time.perf_counter()
+        with db_upload.EmbedPool(workers=workers, chunk_size=args.chunk_size) as pool:
+            pool.embed(texts[: min(len(texts), args.chunk_size * workers)])  # warm every worker
+            t1 = time.perf_counter()
+            vectors = pool.embed(texts)
+            t2 = time.perf_counter()
+        if reference is None:
+            reference = vectors
+        row = {
+            "workers": workers,
+            "texts": len(texts),
+            "startup_s": round(t1 - t0, 3),
+            "encode_s": round(t2 - t1, 3),
+            "texts_per_s": round(len(texts) / (t2 - t1), 1),
+            "max_abs_diff_vs_first": float(np.max(np.abs(vectors - reference))),
+            "dtype": str(vectors.dtype),
+        }
+        rows.append(row)
+        print(
+            f"workers={workers:<3} startup={row['startup_s']:>7.2f}s encode={row['encode_s']:>7.2f}s "
+            f"{row['texts_per_s']:>9.1f} texts/s  speedup={rows[0]['encode_s'] / row['encode_s']:.2f}x  "
+            f"max|diff|={row['max_abs_diff_vs_first']:.2e}"
+        )
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({"model": db_upload.MODEL_NAME, "cpus": os.cpu_count(), "runs": rows}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
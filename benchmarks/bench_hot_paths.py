@@ -0,0 +1,188 @@
+"""
+Offline micro-benchmarks of the ingest and retrieval hot paths.
+
+    python benchmarks/bench_hot_paths.py --out bench.json
+    python benchmarks/bench_hot_paths.py --compare bench.json   # vs. an earlier run
+
+Cases: clean_json.infer_product_type / clean_products and
+db_upload.transform_product on products_rogue.json, db_upload.embed at each
+--batch-sizes, agent_utils.json_to_str on rule-expanded queries, and
+search_catalog / search_glossary against InProcessBackend. Nothing talks to
+Milvus or OpenAI: the vector store, catalog version, BM25, glossary
+embeddings and cache files live in a throwaway directory, and Hugging Face runs offline (the embedding
+model must already be in the local cache).
+
+Each case runs --repeat rounds after one warm-up round; times are per call
+(min / median / p95 over the rounds). --out writes them with the commit and
+environment; --compare prints median ratios against such a file and exits 1
+when a case got slower than --threshold.
+"""
+import argparse
+import atexit
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "webscraping"))
+
+# everything the modules below open at import time goes to a scratch dir
+SCRATCH = tempfile.mkdtemp(prefix="bench_hot_paths_")
+atexit.register(shutil.rmtree, SCRATCH, ignore_errors=True)
+os.environ.update({
+    "VECTOR_BACKEND": "inprocess",
+    "VECTOR_STORE_DIR": os.path.join(SCRATCH, "vector_store"),
+    "CATALOG_VERSION_DIR": os.path.join(SCRATCH, "versions"),
+    "LEXICAL_INDEX_PATH": os.path.join(SCRATCH, "bm25.jsonl"),
+    "EMBED_CACHE_PATH": os.path.join(SCRATCH, "embeddings.sqlite"),
+    "EXPANSION_CACHE_PATH": os.path.join(SCRATCH, "expansions.sqlite"),
+    "GLOSSARY_INDEX_DIR": os.path.join(SCRATCH, "glossary"),
+})
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+
+import numpy as np  # noqa: E402
+
+import clean_json  # noqa: E402
+import db_upload  # noqa: E402
+import glossary_service  # noqa: E402
+from agent_utils import json_to_str  # noqa: E402
+from facet_extractor import extract_facets  # noqa: E402
+
+
+def bench(name: str, fn, calls: int, repeat: int, **params) -> dict:
+    """fn() makes `calls` calls of the thing measured; times are per call in microseconds."""
+    fn()  # warm-up: lazy loads, caches, allocator
+    rounds = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        rounds.append((time.perf_counter() - t0) / calls * 1e6)
+    rounds.sort()
+    row = {
+        "name": name,
+        "params": params,
+        "calls": calls,
+        "repeat": repeat,
+        "us_min": round(rounds[0], 3),
+        "us_median": round(float(np.median(rounds)), 3),
+        "us_p95": round(float(np.percentile(rounds, 95)), 3),
+    }
+    print(f"{label(row):<48} median={row['us_median']:>12.2f} us  "
+          f"min={row['us_min']:>12.2f}  p95={row['us_p95']:>12.2f}  ({calls} calls/round)")
+    return row
+
+
+def label(row: dict) -> str:
+    return " ".join([row["name"], *(f"{k}={v}" for k, v in row["params"].items())])
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def compare(runs: list, path: str, threshold: float) -> int:
+    with open(path, "r", encoding="utf-8") as f:
+        before = {(r["name"], json.dumps(r["params"], sort_keys=True)): r for r in json.load(f)["runs"]}
+    print(f"\nvs. {path} (slower than x{1 + threshold:.2f} = regression)")
+    regressions = 0
+    for r in runs:
+        old = before.get((r["name"], json.dumps(r["params"], sort_keys=True)))
+        if old is None or not old["us_median"]:
+            continue
+        ratio = r["us_median"] / old["us_median"]
+        flag = "REGRESSION" if ratio > 1 + threshold else ""
+        regressions += bool(flag)
+        print(f"{label(r):<48} {old['us_median']:>12.2f} -> {r['us_median']:>12.2f} us  x{ratio:.2f} {flag}")
+    return regressions
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--in", dest="inp", default=os.path.join(ROOT, "products_rogue.json"),
+                    help="raw Shopify export (products_rogue.json)")
+    ap.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32, 128])
+    ap.add_argument("--repeat", type=int, default=20)
+    ap.add_argument("--topk", type=int, default=5)
+    ap.add_argument("--out", default=None, help="JSON results file")
+    ap.add_argument("--compare", default=None, help="earlier --out file to compare against")
+    ap.add_argument("--threshold", type=float, default=0.2, help="allowed median slowdown for --compare")
+    args = ap.parse_args()
+    repeat = args.repeat
+    runs = []
+
+    # ---------- ingest ----------
+    raw = list(db_upload.iter_products(args.inp))
+    print(f"{len(raw)} raw products from {os.path.relpath(args.inp, ROOT)}")
+    fields = [(p.get("title"), p.get("handle"), p.get("tags"),
+               p.get("body_html") or p.get("descriptionHtml") or p.get("description")) for p in raw]
+    runs.append(bench("infer_product_type", lambda: [clean_json.infer_product_type(*f) for f in fields],
+                      len(fields), repeat))
+    runs.append(bench("clean_products", lambda: clean_json.clean_products(raw), 1, repeat,
+                      products=len(raw)))
+    cleaned = clean_json.clean_products(raw)
+    runs.append(bench("transform_product", lambda: [db_upload.transform_product(p) for p in cleaned],
+                      len(cleaned), repeat))
+    products = [db_upload.transform_product(p) for p in cleaned]
+
+    # ---------- embedding ----------
+    texts = [t["search_text"] for t in products]
+    for bs in args.batch_sizes:
+        batch = [texts[i % len(texts)] for i in range(bs)]
+        # fewer rounds for big batches; the model dominates and is stable
+        runs.append(bench("embed", lambda: db_upload.embed(batch), 1, max(3, repeat * 8 // max(bs, 8)),
+                          batch_size=bs))
+
+    # ---------- query building ----------
+    queries = [t["title"] for t in products if t["title"]] + sorted(glossary_service.get_glossary())
+    expanded = [extract_facets(q)[0] for q in queries]
+    runs.append(bench("json_to_str", lambda: [json_to_str(e) for e in expanded], len(expanded), repeat))
+
+    # ---------- retrieval ----------
+    db_upload.ingest(cleaned, progress=None)
+    db_upload.embed_queries(queries)  # query vectors cached: the search path, not the model
+
+    def search_all():
+        for q in queries:
+            db_upload.search_catalog(q, topk=args.topk)
+
+    def search_all_uncached():
+        db_upload.result_cache.clear()
+        search_all()
+
+    runs.append(bench("search_catalog", search_all_uncached, len(queries), repeat,
+                      result_cache="miss", topk=args.topk))
+    runs.append(bench("search_catalog", search_all, len(queries), repeat,
+                      result_cache="hit", topk=args.topk))
+    runs.append(bench("search_glossary", lambda: [glossary_service.search_glossary(q) for q in queries],
+                      len(queries), repeat))
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({
+                "commit": git_commit(),
+                "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                "python": platform.python_version(),
+                "numpy": np.__version__,
+                "machine": f"{platform.system()} {platform.machine()} cpus={os.cpu_count()}",
+                "model": db_upload.MODEL_NAME,
+                "products": len(products),
+                "queries": len(queries),
+                "runs": runs,
+            }, f, indent=2)
+    if args.compare and compare(runs, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Recall vs. memory of quantized catalog vectors, measured on our own catalog.
+
+    python benchmarks/bench_quantization.py --topk 10 --rerank 1 2 4 8
+    python benchmarks/bench_quantization.py --milvus    # also HNSW / HNSW_SQ / IVF_SQ8 in Milvus
+
+Catalog vectors are the transform_product search_text of --in; queries are
+the product titles plus every glossary vibe. Ground truth is exact float32
+inner product. The in-process runs use InProcessBackend (VECTOR_QUANT=int8)
+on a throwaway store; "rerank=1" is the int8 ranking with no extra candidates.
+Resident bytes are projected to --project-rows products per store.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np  # noqa: E402
+
+import db_upload  # noqa: E402
+import glossary_service  # noqa: E402
+import vector_backend  # noqa: E402
+
+
+def catalog(path: str):
+    products = [db_upload.transform_product(p) for p in db_upload.iter_products(path)]
+    vectors, _ = db_upload.embed_with_cache([t["search_text"] for t in products])
+    queries = [t["title"] for t in products if t.get("title")] + sorted(glossary_service.get_glossary())
+    return products, vectors, queries
+
+
+def recall(got, truth) -> float:
+    return float(np.mean([len(set(g) & set(t)) / max(len(t), 1) for g, t in zip(got, truth)]))
+
+
+def run_backend(backend, name, qvecs, topk):
+    t0 = time.perf_counter()
+    res = backend.search(name, qvecs, topk)
+    elapsed = time.perf_counter() - t0
+    return [[m["id"] for m, _ in hits] for hits in res], elapsed * 1000 / len(qvecs)
+
+
+def milvus_index_bytes(index_type: str, rows: int, dim: int) -> int:
+    # rough index size estimates (graph links for HNSW with M=16, IVF centroids)
+    graph = rows * 16 * 2 * 4
+    if index_type == "HNSW":
+        return rows * dim * 4 + graph
+    if index_type == "HNSW_SQ":
+        return rows * dim + graph
+    return rows * dim + vector_backend.MILVUS_NLIST * dim * 4
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--in", dest="inp", default=os.path.join(ROOT, "products.json"))
+    ap.add_argument("--topk", type=int, default=10)
+    ap.add_argument("--rerank", type=int, nargs="+", default=[1, 2, 4, 8])
+    ap.add_argument("--project-rows", type=int, default=100_000)
+    ap.add_argument("--milvus", action="store_true", help="also build each Milvus index type in scratch collections")
+    ap.add_argument("--out", default=None, help="optional JSON results file")
+    args = ap.parse_args()
+
+    products, vectors, queries = catalog(args.inp)
+    rows, dim = vectors.shape
+    qvecs = db_upload.embed_queries(queries)
+    exact = qvecs @ vectors.T
+    truth = [[products[i]["id"] for i in vector_backend.top_k(s, args.topk)] for s in exact]
+    print(f"catalog={rows} rows x {dim} dims, {len(queries)} queries, recall@{args.topk}")
+
+    results = []
+
+    def report(row):
+        results.append(row)
+        print(
+            f"{row['store']:<9} {row['config']:<18} recall={row['recall']:.4f}  {row['ms_per_query']:>7.3f} ms/q  "
+            f"resident={row['bytes_per_vector']:>5} B/vec  "
+            f"{row['projected_mb']:>8.1f} MB @ {args.project_rows} rows"
+        )
+
+    with tempfile.TemporaryDirectory() as tmp:
+        name = "bench_quant"
+        for quant, factors in (("none", [1]), ("int8", args.rerank)):
+            backend = vector_backend.InProcessBackend(root=os.path.join(tmp, quant), quant=quant)
+            backend.ensure(name, dim)
+            backend.insert(name, [{"id": t["id"], "vector": v, "metadata": {"id": t["id"]}}
+                                  for t, v in zip(products, vectors)])
+            backend.flush(name)
+            # int8 keeps codes + one float scale per row resident; float32 vectors stay on disk
+            per_vec = dim * 4 if quant == "none" else dim + 4
+            for factor in factors:
+                backend.rerank_factor = factor
+                got, ms = run_backend(backend, name, qvecs, args.topk)
+                report({
+                    "store": "inprocess",
+                    "config": "float32 exact" if quant == "none" else f"int8 rerank={factor}",
+                    "recall": recall(got, truth),
+                    "ms_per_query": round(ms, 4),
+                    "bytes_per_vector": per_vec,
+                    "projected_mb": round(per_vec * args.project_rows / 2**20, 1),
+                })
+
+    if args.milvus:
+        milvus = vector_backend.MilvusBackend()
+        for index_type in ("HNSW", "HNSW_SQ", "IVF_SQ8"):
+            name = f"bench_quant_{index_type.lower()}"
+            vector_backend.MILVUS_INDEX = index_type
+            from pymilvus import utility
+            if utility.has_collection(name):
+                utility.drop_collection(name)
+            milvus.ensure(name, dim)
+            milvus.insert(name, [{"id": t["id"], "vector": v.tolist(), "metadata": {"id": t["id"]}}
+                                 for t, v in zip(products, vectors)])
+            milvus.flush(name)
+            got, ms = run_backend(milvus, name, qvecs, args.topk)
+            per_vec = milvus_index_bytes(index_type, 1, dim)
+            report({
+                "store": "milvus",
+                "config": index_type + (f" rerank={vector_backend.RERANK_FACTOR}"
+                                        if index_type in vector_backend._MILVUS_QUANTIZED else ""),
+                "recall": recall(got, truth),
+                "ms_per_query": round(ms, 4),
+                "bytes_per_vector": per_vec,
+                "projected_mb": round(milvus_index_bytes(index_type, args.project_rows, dim) / 2**20, 1),
+            })
+            utility.drop_collection(name)
+            vector_backend.milvus_conn.forget(name)
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({"model": db_upload.MODEL_NAME, "rows": rows, "dim": dim, "queries": len(queries),
+                       "topk": args.topk, "project_rows": args.project_rows, "runs": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+import os
+import json
+import threading
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+# Keeps what is sent to the chat model under a token budget, so prompt size
+# (and latency) stays flat as a conversation grows:
+#   - history beyond HISTORY_TOKEN_BUDGET is dropped, newest kept, and the
+#     dropped turns are folded into one short extractive summary message
+#   - product results are remembered as one-line digests, not raw JSON
+#   - inside a turn, tool results from earlier iterations shrink to digests
+#     once the working transcript passes WORKING_TOKEN_BUDGET
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "3000"))
+SUMMARY_TOKEN_BUDGET = int(os.getenv("SUMMARY_TOKEN_BUDGET", "400"))
+WORKING_TOKEN_BUDGET = int(os.getenv("WORKING_TOKEN_BUDGET", "8000"))
+TOKEN_MODEL = os.getenv("TOKEN_MODEL", "gpt-4o")
+
+_MESSAGE_OVERHEAD = 4  # role/separators per message in the chat format
+DIGEST_MAX_PRODUCTS = 8
+
+
+# ---------- counting ----------
+_encoder = None
+_encoder_lock = threading.Lock()
+
+def _get_encoder():
+    # tiktoken is optional; without it tokens are estimated as chars / 4
+    global _encoder
+    if _encoder is None:
+        with _encoder_lock:
+            if _encoder is None:
+                try:
+                    import tiktoken
+                    try:
+                        _encoder = tiktoken.encoding_for_model(TOKEN_MODEL)
+                    except KeyError:
+                        _encoder = tiktoken.get_encoding("o200k_base")
+                except ImportError:
+                    _encoder = False
+    return _encoder
+
+@lru_cache(maxsize=8192)
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    enc = _get_encoder()
+    if enc:
+        return len(enc.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+def message_tokens(msg: Dict[str, Any]) -> int:
+    n = _MESSAGE_OVERHEAD + count_tokens(msg.get("content") or "")
+    if msg.get("tool_calls"):
+        n += count_tokens(json.dumps(msg["tool_calls"], ensure_ascii=False))
+    return n
+
+def total_tokens(messages: List[Dict[str, Any]]) -> int:
+    return sum(message_tokens(m) for m in messages)
+
+
+# ---------- product digests ----------
+def _products_in(output: Any) -> Optional[List[Dict]]:
+    # catalog_search_tool returns a list of hits, find_products_tool a dict with "products"
+    if isinstance(output, dict):
+        output = output.get("products")
+    if isinstance(output, list) and all(isinstance(h, dict) and "title" in h for h in output):
+        return output
+    return None
+
+def digest_products(products: List[Dict], limit: int = DIGEST_MAX_PRODUCTS) -> str:
+    """'#123 Rogue Bat Thermal (Thermal, $64); ...' for the first `limit` products."""
+    parts = []
+    for h in products[:limit]:
+        price = h.get("price", h.get("price_min"))
+        facts = ", ".join(str(x) for x in (h.get("product_type"), f"${price}" if price is not None else None) if x)
+        parts.append(f"#{h.get('id')} {h['title']}" + (f" ({facts})" if facts else ""))
+    more = len(products) - limit
+    return "; ".join(parts) + (f"; +{more} more" if more > 0 else "")
+
+def digest_tool_output(output: Any) -> Optional[str]:
+    products = _products_in(output)
+    if products is None:
+        return None
+    return digest_products(products) if products else "no products found"
+
+
+# ---------- history ----------
+def _clip(text: str, max_chars: int) -> str:
+    text = " ".join((text or "").split())
+    return text if len(text) <= max_chars else text[: max_chars - 1] + "…"
+
+def summarize_dropped(dropped: List[Dict[str, Any]], budget: int = SUMMARY_TOKEN_BUDGET) -> str:
+    """
+    Extractive summary of turns that no longer fit: what the user asked for
+    and which products were shown, newest first, cut at `budget` tokens.
+    """
+    lines = []
+    for m in reversed(dropped):
+        if m["role"] == "user":
+            lines.append(f"- user asked: {_clip(m.get('content'), 160)}")
+        elif m["role"] == "system" and (m.get("content") or "").startswith(PRODUCTS_SHOWN_PREFIX):
+            lines.append(f"- {_clip(m['content'], 240)}")
+    header = "Summary of earlier conversation (older turns omitted):"
+    out, used = [header], count_tokens(header)
+    for line in lines:
+        used += count_tokens(line)
+        if used > budget:
+            break
+        out.append(line)
+    return "\n".join(out)
+
+def compact_history(messages: List[Dict[str, Any]], budget: int = HISTORY_TOKEN_BUDGET) -> List[Dict[str, Any]]:
+    """
+    The newest messages that fit in `budget` tokens (the latest message is
+    always kept), preceded by a summary of the rest when anything was dropped.
+    """
+    messages = list(messages)
+    kept: List[Dict[str, Any]] = []
+    used = 0
+    for m in reversed(messages):
+        n = message_tokens(m)
+        if kept and used + n > budget:
+            break
+        kept.append(m)
+        used += n
+    kept.reverse()
+    dropped = messages[: len(messages) - len(kept)]
+    if not dropped:
+        return kept
+    # don't open the window on an orphaned assistant reply
+    while len(kept) > 1 and kept[0]["role"] == "assistant":
+        dropped.append(kept.pop(0))
+    return [{"role": "system", "content": summarize_dropped(dropped)}, *kept]
+
+
+PRODUCTS_SHOWN_PREFIX = "Products shown for the previous request:"
+
+def products_shown_message(digests: List[str]) -> Dict[str, Any]:
+    """History entry recording what the assistant was grounded on this turn."""
+    return {"role": "system", "content": f"{PRODUCTS_SHOWN_PREFIX} " + " | ".join(digests)}
+
+
+# ---------- within a turn ----------
+_COMPACTED = '{"digest": '
+
+def compact_tool_results(working: List[Dict[str, Any]], keep_from: int,
+                         budget: int = WORKING_TOKEN_BUDGET) -> None:
+    """
+    Over budget, replace the content of tool messages before index
+    `keep_from` (earlier tool iterations) with their digests, in place.
+    """
+    if total_tokens(working) <= budget:
+        return
+    for i, m in enumerate(working[:keep_from]):
+        if m["role"] != "tool" or m["content"].startswith(_COMPACTED):
+            continue
+        try:
+            digest = digest_tool_output(json.loads(m["content"]))
+        except (TypeError, ValueError):
+            digest = None
+        working[i] = {**m, "content": _COMPACTED + json.dumps(digest or _clip(m["content"], 400), ensure_ascii=False) + "}"}
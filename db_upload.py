@@ -1,15 +1,30 @@
 import re 
+import os
 import json
 import html
-from sentence_transformers import SentenceTransformer
-from pymilvus import (
-    connections, FieldSchema, CollectionSchema, DataType,
-    Collection, utility
+import time
+import argparse
+import logging
+import threading
+from collections import OrderedDict, deque
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from embedding_cache import embed_cached
+from vector_backend import (
+    BOOL, FLOAT, STR, STR_LIST, ARRAY_ELEM_MAX, ARRAY_MAX, VARCHAR_MAX,
+    build_filter_expr, bump_version, canonical_product_type, canonical_sizes, collection_version,
+    get_backend, matches_filters,
 )
-from typing import List, Dict
+from lexical_index import BM25Writer, LexicalIndexFile, remove_documents, rrf_merge
+from metrics import configure_logging, register_cache, stage
 
+logger = logging.getLogger("tailord.db_upload")
 
-COLLECTION_NAME = "products_rogue_v1"
+
+# v2: scalar filter fields next to the JSON metadata (v1 had metadata only)
+# v3: canonical `sizes` field, lower-cased product_type field
+COLLECTION_NAME = "products_rogue_v3"
 import numpy as np
 
 def strip_html(html_text: str) -> str:
@@ -79,59 +94,435 @@ def transform_product(p: dict) -> dict:
         "features": features,
         "img": (variants[0].get("img_src") if variants else None) or None,
         "sizes_in_stock": sizes_in_stock,
+        "sizes": canonical_sizes(sizes_in_stock),  # what size filters match
         "in_stock": in_stock,
         "price_min": min([float(v.get("price")) for v in variants if v.get("price")], default=None),
         "price_max": max([float(v.get("price")) for v in variants if v.get("price")], default=None),
         "search_text": search_text
     }
-    print(search_text)
+    logger.debug("search_text: %s", search_text)
     return out
 
 
 MODEL_NAME = "all-MiniLM-L6-v2"
-model = SentenceTransformer(MODEL_NAME)
+
+# The model (and torch behind it) is loaded on first use, not at import, so
+# importing this module stays cheap for the API, CLIs and one-off scripts.
+_model = None
+_model_lock = threading.Lock()
+
+def get_model():
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                from sentence_transformers import SentenceTransformer
+                _model = SentenceTransformer(MODEL_NAME)
+    return _model
+
+def model_loaded() -> bool:
+    return _model is not None
+
+def __getattr__(name):
+    # keep `db_upload.model` working for existing callers
+    if name == "model":
+        return get_model()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def embed(texts: List[str]) -> np.ndarray:
-    vecs = model.encode(texts, normalize_embeddings=True)  # cosine-ready
+    with stage("embed"):
+        vecs = get_model().encode(texts, normalize_embeddings=True)  # cosine-ready
     return np.asarray(vecs, dtype="float32")
 
+class QueryEmbeddingCache:
+    """
+    Bounded, thread-safe LRU of query embeddings keyed by (model name,
+    normalized text). Cached vectors are read-only float32 arrays.
+    """
+
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[tuple, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            vec = self._data.get(key)
+            if vec is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return vec
+
+    def put(self, key, vec: np.ndarray) -> None:
+        with self._lock:
+            self._data[key] = vec
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+query_cache = QueryEmbeddingCache(int(os.getenv("QUERY_EMBED_CACHE_SIZE", "4096")))
+register_cache("query_embedding", query_cache.stats)
+
+def normalize_query(text: str) -> str:
+    # MiniLM's tokenizer is uncased and whitespace-insensitive, so this does
+    # not change the embedding, only improves the hit rate
+    return " ".join((text or "").split()).lower()
+
+def embed_query(query: str) -> np.ndarray:
+    """Embed a single search query (1-D float32), served from query_cache when possible."""
+    text = normalize_query(query)
+    key = (MODEL_NAME, text)
+    vec = query_cache.get(key)
+    if vec is None:
+        vec = embed(text)
+        vec.setflags(write=False)
+        query_cache.put(key, vec)
+    return vec
+
+def embed_queries(queries: List[str]) -> np.ndarray:
+    """Embed several queries (2-D float32); cache misses are encoded in one batch."""
+    texts = [normalize_query(q) for q in queries]
+    vecs = [query_cache.get((MODEL_NAME, t)) for t in texts]
+    missing = list(dict.fromkeys(t for t, v in zip(texts, vecs) if v is None))
+    if missing:
+        fresh = {}
+        for t, row in zip(missing, embed(missing)):
+            row = np.array(row, dtype="float32")
+            row.setflags(write=False)
+            query_cache.put((MODEL_NAME, t), row)
+            fresh[t] = row
+        vecs = [v if v is not None else fresh[t] for t, v in zip(texts, vecs)]
+    if not vecs:
+        return np.zeros((0, 0), dtype="float32")
+    return np.stack(vecs)
+
+def embed_with_cache(texts: List[str], embed_fn: Callable[[List[str]], np.ndarray] = None) -> Tuple[np.ndarray, Dict[str, int]]:
+    """Bulk embed through the on-disk cache; returns (vectors, {"hits", "misses"})."""
+    return embed_cached(texts, embed_fn or embed, MODEL_NAME)
+
+# ---------- multi-process bulk embedding ----------
+EMBED_CHUNK_SIZE = 256
+
+def _init_embed_worker(torch_threads: int):
+    # one model copy per process; split the cores so workers don't oversubscribe
+    import torch
+    torch.set_num_threads(torch_threads)
+    get_model()
+
+def _embed_chunk(texts: List[str]) -> np.ndarray:
+    return embed(texts)
+
+class EmbedPool:
+    """
+    Pool of worker processes, each holding its own model copy, for CPU bulk
+    embedding. Texts are split into `chunk_size` pieces and results are
+    reassembled in input order, so output matches embed() row for row.
+
+        with EmbedPool(workers=4) as pool:
+            vectors = pool.embed(texts)
+    """
+
+    def __init__(self, workers: Optional[int] = None, chunk_size: int = EMBED_CHUNK_SIZE):
+        cpus = os.cpu_count() or 1
+        self.workers = max(1, workers or cpus)
+        self.chunk_size = chunk_size
+        self._executor = None
+        if self.workers > 1:
+            # spawn, not fork: forking a process that already started torch threads can deadlock
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_embed_worker,
+                initargs=(max(1, cpus // self.workers),),
+            )
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        if self._executor is None or len(texts) <= self.chunk_size:
+            return embed(texts)
+        chunks = [texts[i:i + self.chunk_size] for i in range(0, len(texts), self.chunk_size)]
+        # Executor.map yields in submission order -> deterministic output order
+        return np.concatenate(list(self._executor.map(_embed_chunk, chunks)), axis=0)
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def __enter__(self) -> "EmbedPool":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+def embed_bulk(texts: List[str], workers: Optional[int] = None, chunk_size: int = EMBED_CHUNK_SIZE) -> np.ndarray:
+    """One-off multi-process embed; for repeated calls keep an EmbedPool open instead."""
+    with EmbedPool(workers=workers, chunk_size=chunk_size) as pool:
+        return pool.embed(texts)
+
+def warmup():
+    # load the model and run one encode so the first real query pays nothing
+    embed(["warmup"])
+
+# filterable scalar fields stored next to the vector (and inside metadata)
+CATALOG_FIELDS = (
+    ("price_min", FLOAT),
+    ("price_max", FLOAT),
+    ("product_type", STR),
+    ("in_stock", BOOL),
+    ("sizes", STR_LIST),
+)
+
 def ensure_collection(dim: int):
-    if utility.has_collection(COLLECTION_NAME):
-        return Collection(COLLECTION_NAME)
-
-    fields = [
-        FieldSchema(name="id", dtype=DataType.INT64, is_primary=True, auto_id=False),
-        FieldSchema(name="vector", dtype=DataType.FLOAT_VECTOR, dim=dim),
-        FieldSchema(name="metadata", dtype=DataType.JSON)   # store the transformed record here
-    ]
-    schema = CollectionSchema(fields, description="Product catalog with vector + JSON metadata")
-    col = Collection(name=COLLECTION_NAME, schema=schema)
-
-    # Build an HNSW index (good for cosine/IP; we normalized vectors above)
-    col.create_index(
-        field_name="vector",
-        index_params={
-            "index_type": "HNSW",
-            "metric_type": "IP",
-            "params": {"M": 16, "efConstruction": 200}
-        }
-    )
-    return col
-
-def ingest(raw_products: List[Dict]):
-    # 1) transform
-    transformed = [transform_product(p) for p in raw_products]
-    # 2) embed
-    texts = [t["search_text"] for t in transformed]
-    vectors = embed(texts)
-    # 3) connect + create collection
-    connections.connect(alias="default", host="127.0.0.1", port="19530")
-    col = ensure_collection(dim=vectors.shape[1])
-    # 4) insert
-    ids = [int(t["id"]) for t in transformed]
-    metas = transformed  # store whole object
-    col.insert([ids, vectors, metas])
-    col.flush()
+    get_backend().ensure(COLLECTION_NAME, dim, CATALOG_FIELDS)
+
+def to_row(t: Dict, vector) -> Dict:
+    # one insert row for a transform_product() record
+    return {
+        "id": int(t["id"]),
+        "vector": vector,
+        "price_min": t["price_min"],
+        "price_max": t["price_max"],
+        "product_type": canonical_product_type(t["product_type"])[:VARCHAR_MAX],
+        "in_stock": bool(t["in_stock"]),
+        "sizes": [s[:ARRAY_ELEM_MAX] for s in t["sizes"][:ARRAY_MAX]],
+        "metadata": t,  # store whole object
+    }
+
+# ---------- lexical (BM25) side index ----------
+LEXICAL_INDEX_PATH = os.getenv(
+    "LEXICAL_INDEX_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", f"bm25_{COLLECTION_NAME}.jsonl"),
+)
+lexical = LexicalIndexFile(LEXICAL_INDEX_PATH)
+
+def lexical_record(t: Dict) -> Dict:
+    # the fields format_hit and the filters need, nothing more
+    return {k: t[k] for k in ("id", "title", "product_type", "in_stock",
+                              "sizes_in_stock", "sizes", "handle", "price_min", "price_max")}
+
+# ---------- streaming ingest ----------
+INGEST_BATCH_SIZE = 256
+
+def _iter_json_array(f, buf_size: int = 1 << 16) -> Iterator[Dict]:
+    # yields the elements of a JSON array one at a time; `f` is positioned
+    # just past the opening "["
+    decoder = json.JSONDecoder()
+    buf = ""
+    while True:
+        buf = buf.lstrip()
+        if buf.startswith(","):
+            buf = buf[1:].lstrip()
+        if buf.startswith("]"):
+            return
+        try:
+            obj, end = decoder.raw_decode(buf)
+        except json.JSONDecodeError:
+            chunk = f.read(buf_size)
+            if not chunk:
+                raise
+            buf += chunk
+            continue
+        yield obj
+        buf = buf[end:]
+
+def iter_products(path: str) -> Iterator[Dict]:
+    """
+    Stream products from a JSON array, a {"products": [...]} export or a
+    JSONL file without loading the whole file into memory.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+            return
+        head = ""
+        while True:
+            ch = f.read(1)
+            if not ch:
+                return
+            head += ch
+            if ch == "[":
+                break
+            if len(head) > 1 << 16:
+                raise ValueError(f"{path}: no product array found near the start of the file")
+        # a bare array, or the first array after the "products" key
+        if head.lstrip().startswith("{") and '"products"' not in head:
+            raise ValueError(f"{path}: expected a top-level array or a \"products\" key")
+        yield from _iter_json_array(f)
+
+def _batched(items: Iterable, n: int) -> Iterator[List]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == n:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _read_checkpoint(path: Optional[str], batch_size: int) -> Tuple[int, int]:
+    # (last written chunk index, products written so far)
+    if not path or not os.path.exists(path):
+        return -1, 0
+    with open(path, "r", encoding="utf-8") as f:
+        ckpt = json.load(f)
+    if ckpt.get("collection") != COLLECTION_NAME or ckpt.get("batch_size") != batch_size:
+        raise ValueError(f"checkpoint {path} was written for {ckpt}; remove it or match its batch_size")
+    return int(ckpt["last_chunk"]), int(ckpt.get("products", 0))
+
+def _write_checkpoint(path: Optional[str], batch_size: int, chunk_idx: int, done: int) -> None:
+    if not path:
+        return
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"collection": COLLECTION_NAME, "batch_size": batch_size,
+                   "last_chunk": chunk_idx, "products": done}, f)
+    os.replace(tmp_path, path)
+
+def ingest(raw_products: Iterable[Dict],
+           batch_size: int = INGEST_BATCH_SIZE,
+           max_in_flight: int = 2,
+           checkpoint_path: Optional[str] = None,
+           progress: Optional[Callable[[Dict], None]] = print,
+           use_embed_cache: bool = True,
+           embed_workers: int = 1):
+    """
+    Transform, embed and write products chunk by chunk.
+
+    Memory stays bounded by `batch_size` * `max_in_flight`: while chunk N is
+    being written by the single writer thread, chunk N+1 is transformed and
+    embedded. Rows are upserted, so replaying a chunk after a crash is
+    harmless. With `checkpoint_path`, the index of the last written chunk is
+    recorded and a rerun skips everything up to it. With `use_embed_cache`,
+    only texts missing from the on-disk embedding cache are encoded.
+    `embed_workers` > 1 spreads encoding over an EmbedPool of processes.
+
+    The BM25 side index at LEXICAL_INDEX_PATH gets every product seen,
+    including chunks skipped on resume. Like the vector store it is upserted:
+    documents are streamed to a new file as chunks are transformed, the saved
+    documents that were not seen are copied after them, and the result
+    replaces the old file. Products leave both only through delete_products().
+    """
+    resume_after, written = _read_checkpoint(checkpoint_path, batch_size)
+    backend = get_backend()
+    ensured = False
+    writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest-writer")
+    # split each ingest chunk evenly across the workers
+    pool = EmbedPool(workers=embed_workers, chunk_size=max(1, -(-batch_size // max(1, embed_workers))))
+    in_flight = deque()
+    started = time.perf_counter()
+    resumed_from = written
+    cache_hits = cache_total = 0
+
+    def hit_ratio() -> float:
+        return round(cache_hits / cache_total, 3) if cache_total else 0.0
+
+    failed = threading.Event()
+    lexical_out = BM25Writer(LEXICAL_INDEX_PATH, base=LEXICAL_INDEX_PATH)
+
+    def write(chunk_idx: int, rows: List[Dict]):
+        # single writer thread, so chunks land (and are checkpointed) in order;
+        # after a failure nothing later may be written, or resume would skip a gap.
+        # insert() returns once the rows are durable (VectorBackend contract),
+        # so the checkpoint never runs ahead of what is stored
+        nonlocal written
+        if failed.is_set():
+            return
+        try:
+            backend.insert(COLLECTION_NAME, rows)
+        except Exception:
+            failed.set()
+            raise
+        written += len(rows)
+        _write_checkpoint(checkpoint_path, batch_size, chunk_idx, written)
+
+    try:
+        for chunk_idx, chunk in enumerate(_batched(raw_products, batch_size)):
+            if failed.is_set():
+                break
+            # 1) transform
+            transformed = [transform_product(p) for p in chunk]
+            for t in transformed:
+                lexical_out.add(int(t["id"]), t["search_text"], lexical_record(t))
+            if chunk_idx <= resume_after:
+                continue
+            # 2) embed
+            texts = [t["search_text"] for t in transformed]
+            if use_embed_cache:
+                vectors, stats = embed_with_cache(texts, pool.embed)
+                cache_hits += stats["hits"]
+                cache_total += len(texts)
+            else:
+                vectors = pool.embed(texts)
+            # 3) create collection on first chunk
+            if not ensured:
+                ensure_collection(dim=vectors.shape[1])
+                ensured = True
+            # 4) insert in the background, bounded
+            while len(in_flight) >= max_in_flight:
+                in_flight.popleft().result()
+            rows = [to_row(t, v) for t, v in zip(transformed, vectors)]
+            in_flight.append(writer.submit(write, chunk_idx, rows))
+
+            if progress:
+                elapsed = time.perf_counter() - started
+                progress({"chunk": chunk_idx, "written": written,
+                          "per_sec": round((written - resumed_from) / elapsed, 1) if elapsed else 0.0,
+                          "cache_hit_ratio": hit_ratio()})
+        while in_flight:
+            in_flight.popleft().result()
+        if ensured:
+            backend.flush(COLLECTION_NAME)
+    except BaseException:
+        lexical_out.abort()
+        raise
+    finally:
+        writer.shutdown(wait=True)
+        pool.close()
+
+    lexical_out.commit()
+    # hybrid results also depend on the lexical index saved just now
+    bump_version(COLLECTION_NAME)
+    if checkpoint_path and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    if progress:
+        progress({"chunk": "done", "written": written,
+                  "seconds": round(time.perf_counter() - started, 2),
+                  "cache_hit_ratio": hit_ratio()})
+    return written
+
+
+def delete_products(ids: List[int]) -> None:
+    """Remove products from the vector store and the BM25 side index."""
+    ids = [int(i) for i in ids]
+    if not ids:
+        return
+    get_backend().delete(COLLECTION_NAME, ids)
+    remove_documents(LEXICAL_INDEX_PATH, ids)
+    # the backend bumped the version before the lexical index changed
+    bump_version(COLLECTION_NAME)
 
 
 def as_float32_list(vec):
@@ -151,69 +542,260 @@ def as_float32_list(vec):
         arr = np.nan_to_num(arr, nan=0.0, posinf=1e6, neginf=-1e6)
     return arr.tolist()
 
-def search_catalog(query: str, topk=5, only_in_stock=True):
-    if not connections.has_connection("default"):
-        connections.connect(alias="default", host="127.0.0.1", port="19530")
-    col = Collection(COLLECTION_NAME)
-    col.load()
-    emb = embed(query)
-    qvec = as_float32_list(emb)
-    # Optional filter on JSON field
-    expr = None
-    if only_in_stock:
-        expr = 'metadata["in_stock"] == true'
-
-    # search
-    res = col.search(
-        data=[qvec],
-        anns_field="vector",
-        param={"metric_type": "IP", "params": {"ef": 64}},
-        limit=topk,
-        expr=expr,
-        output_fields=["metadata"]
-    )
-    # format results
-    out = []
-    for hit in res[0]:
-        meta = hit.entity.get("metadata")
-        out.append({
-            "score": float(hit.distance),
-            "id": meta["id"],
-            "title": meta["title"],
-            "product_type": meta["product_type"],
-            "in_stock": meta["in_stock"],
-            "sizes_in_stock": meta["sizes_in_stock"],
-            "handle": meta["handle"]
-        })
-    return out
-'''
-if __name__ == "__main__":
-    with open("products.json", "r", encoding="utf-8") as f:
-        products = json.load(f)
-    ingest(products)
+def format_hit(meta: Dict, score: float) -> Dict:
+    return {
+        "score": score,
+        "id": meta["id"],
+        "title": meta["title"],
+        "product_type": meta["product_type"],
+        "in_stock": meta["in_stock"],
+        "sizes_in_stock": meta["sizes_in_stock"],
+        "handle": meta["handle"],
+        "price_min": meta.get("price_min"),
+        "price_max": meta.get("price_max"),
+    }
+
+# HNSW ef for the vector leg; lexical candidates cover exact-token recall, so
+# hybrid search runs a smaller ef than vector-only search needs
+VECTOR_EF = 64
+HYBRID_EF = 32
+RRF_K = 60
+
+# ---------- search result cache ----------
+class SearchResultCache:
+    """
+    Bounded LRU of formatted search results with a per-entry TTL. Keys carry
+    the catalog version, so entries from before an ingest are never matched
+    again and simply age out. Concurrent misses on the same key are
+    coalesced: one caller searches, the others wait for its result.
+    """
+
+    def __init__(self, maxsize: int = 2048, ttl_seconds: float = 300.0):
+        self.maxsize = maxsize
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._data: "OrderedDict[tuple, Tuple[float, List[Dict]]]" = OrderedDict()
+        self._inflight: Dict[tuple, threading.Event] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, count: bool = True) -> Optional[List[Dict]]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self._data[key]
+                entry = None
+            if entry is None:
+                self.misses += count
+                return None
+            self._data.move_to_end(key)
+            self.hits += count
+        return [dict(h) for h in entry[1]]  # callers may annotate hits
+
+    def put(self, key, hits: List[Dict]) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl_seconds, [dict(h) for h in hits])
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def claim(self, key) -> Optional[threading.Event]:
+        """None: the caller should search and then release(key). Otherwise an Event to wait on."""
+        with self._lock:
+            event = self._inflight.get(key)
+            if event is None:
+                self._inflight[key] = threading.Event()
+                return None
+            self.coalesced += 1
+            return event
+
+    def release(self, key) -> None:
+        with self._lock:
+            event = self._inflight.pop(key, None)
+        if event is not None:
+            event.set()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = self.coalesced = 0
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+result_cache = SearchResultCache(int(os.getenv("SEARCH_CACHE_SIZE", "2048")),
+                                 float(os.getenv("SEARCH_CACHE_TTL_SECONDS", "300")))
+register_cache("search_result", result_cache.stats)
+SEARCH_WAIT_SECONDS = 10.0  # how long a coalesced miss waits before searching itself
+
+def _filters_key(filters: Dict) -> tuple:
+    return tuple(sorted(
+        # key=str: a stray non-string value must not make the key uncomparable
+        (k, tuple(sorted(v, key=str)) if isinstance(v, (list, tuple, set)) else v)
+        for k, v in filters.items()
+    ))
+
+def search_catalog(query: str, topk=5, only_in_stock=True,
+                   price_min: Optional[float] = None,
+                   price_max: Optional[float] = None,
+                   product_types: Optional[List[str]] = None,
+                   sizes: Optional[List[str]] = None):
+    filters = dict(only_in_stock=only_in_stock, price_min=price_min, price_max=price_max,
+                   product_types=product_types, sizes=sizes)
+    return search_catalog_many([query], topk, filters)[0]
+
+def search_catalog_many(queries: List[str], topk: int = 5,
+                        filters: Optional[Dict] = None,
+                        dedup: bool = False) -> List[List[Dict]]:
+    """
+    Run several catalog queries as one batch: one embed call for the cache
+    misses and one multi-vector Milvus search. `filters` takes the
+    search_catalog keyword filters and applies to every query. With `dedup`,
+    a product is only returned for the first query that ranks it, and later
+    queries are backfilled from deeper candidates. Results are served from
+    result_cache (normalized query + filters + catalog version) when possible.
+    """
+    if not queries:
+        return []
+    filters = {"only_in_stock": True, **(filters or {})}
+    version = collection_version(COLLECTION_NAME)
+    fkey = _filters_key(filters)
+    if dedup:
+        # deduped results depend on the whole batch, so it is part of every key
+        batch = tuple(normalize_query(q) for q in queries)
+        keys = [("batch", batch, i, topk, fkey, version) for i in range(len(queries))]
+        return _cached_search(keys, lambda idx: [
+            hits for i, hits in enumerate(_search_uncached(queries, topk, filters, dedup=True)) if i in idx
+        ])
+    keys = [("query", normalize_query(q), topk, fkey, version) for q in queries]
+    return _cached_search(keys, lambda idx: _search_uncached([queries[i] for i in idx], topk, filters))
+
+def _cached_search(keys: List[tuple], search: Callable[[List[int]], List[List[Dict]]]) -> List[List[Dict]]:
+    """
+    One result list per key, from result_cache where possible.
+    search(indices) computes the results for those positions of `keys`, in
+    order. A key another thread is already searching is waited for instead
+    of being searched twice.
+    """
+    results = {k: hits for k, hits in zip(keys, [result_cache.get(k) for k in keys]) if hits is not None}
+    leading, waiting = [], {}
+    for k in dict.fromkeys(keys):
+        if k in results:
+            continue
+        event = result_cache.claim(k)
+        if event is None:
+            leading.append(k)
+        else:
+            waiting[k] = event
+
+    def compute(todo: List[tuple]) -> None:
+        for k, hits in zip(todo, search([keys.index(k) for k in todo])):
+            result_cache.put(k, hits)
+            results[k] = hits
+
+    try:
+        if leading:
+            compute(leading)
+    finally:
+        for k in leading:
+            result_cache.release(k)
+    for k, event in waiting.items():
+        event.wait(SEARCH_WAIT_SECONDS)
+        hits = result_cache.get(k, count=False)
+        if hits is not None:
+            results[k] = hits
+    late = [k for k in waiting if k not in results]  # the leader failed or timed out
+    if late:
+        compute(late)
+    return [[dict(h) for h in results[k]] for k in keys]
+
+def _search_uncached(queries: List[str], topk: int, filters: Dict, dedup: bool = False) -> List[List[Dict]]:
+    bm25 = lexical.get()
+    limit = topk * 2 if dedup else topk
+
+    qvecs = embed_queries(queries)
+
+    # search; structured filters are evaluated inside the ANN search
+    backend = get_backend()
+    with stage("vector_search", type(backend).__name__):
+        res = backend.search(COLLECTION_NAME, qvecs, limit, filters=filters,
+                             ef=HYBRID_EF if bm25 else VECTOR_EF)
+
+    results = []
+    seen = set()
+    for query, hits in zip(queries, res):
+        # format results
+        ranked = [format_hit(meta, score) for meta, score in hits]
+        if bm25 is not None:
+            # hybrid: fuse with BM25 candidates (same filters) by reciprocal rank
+            with stage("lexical_search"):
+                lex = bm25.search(query, limit, predicate=lambda r: matches_filters(r, **filters))
+            fused = rrf_merge([
+                [(h["id"], h) for h in ranked],
+                [(r["id"], format_hit(r, 0.0)) for r, _ in lex],
+            ], k=RRF_K)
+            ranked = [{**h, "score": round(score, 6)} for h, score in fused]
+        if dedup:
+            ranked = [h for h in ranked if h["id"] not in seen]
+        ranked = ranked[:topk]
+        seen.update(h["id"] for h in ranked)
+        results.append(ranked)
+    return results
 
-'''
 def get_vibe_info(query):
-      
-        data = []
-        with open("glossary_normalized.jsonl", 'r', encoding='utf-8') as f:
-            for line in f:
-                # Strip whitespace (including the newline character) and parse each line
-                try:
-                    data.append(json.loads(line.strip()))
-                except json.JSONDecodeError as e:
-                    print(f"Error decoding JSON on line: {line.strip()} - {e}")
+        # shared, lazily parsed glossary (resolved relative to the repo, not the cwd)
+        from glossary_service import get_glossary
+
         search_queries = []
         vibe_items = []
-        for d in data:
-            if d["vibe"] == query:
-                vibe = d["vibe"]
-                vibe_items = d["items"]
-                vibe_description = d["definition"]
+        entry = get_glossary().get((query or "").lower())
+        if entry:
+            vibe = query
+            vibe_items = entry.get("items", [])
+            vibe_description = entry.get("definition", "")
 
         for item in vibe_items:
             search_text = f"{item} that fits the {vibe} vibe ({vibe_description})"
             search_queries.append(search_text)
         return search_queries
-        
 
+
+def main():
+    ap = argparse.ArgumentParser(description="Stream products into the catalog collection (VECTOR_BACKEND: milvus or inprocess).")
+    ap.add_argument("--in", dest="in_path", default="products.json", help="JSON array, {\"products\": [...]} export or JSONL")
+    ap.add_argument("--batch-size", type=int, default=INGEST_BATCH_SIZE)
+    ap.add_argument("--max-in-flight", type=int, default=2, help="chunks embedded ahead of the writer")
+    ap.add_argument("--checkpoint", default=None, help="resume file; defaults to <in>.ingest.ckpt")
+    ap.add_argument("--no-embed-cache", action="store_true", help="re-encode every text instead of using the on-disk cache")
+    ap.add_argument("--embed-workers", type=int, default=1, help="processes used for encoding (one model copy each)")
+    ap.add_argument("--delete", type=int, nargs="+", metavar="ID",
+                    help="remove these product ids from the catalog instead of ingesting")
+    args = ap.parse_args()
+
+    configure_logging()
+    if args.delete:
+        delete_products(args.delete)
+        return
+    ingest(
+        iter_products(args.in_path),
+        batch_size=args.batch_size,
+        max_in_flight=args.max_in_flight,
+        checkpoint_path=args.checkpoint or f"{args.in_path}.ingest.ckpt",
+        use_embed_cache=not args.no_embed_cache,
+        embed_workers=args.embed_workers,
+    )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+import os
+import sqlite3
+import hashlib
+import threading
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Content-addressed store of embeddings: key = sha256(model name + text),
+# value = raw float32 bytes. Bulk ingest only encodes texts it has never seen.
+EMBED_CACHE_PATH = os.getenv(
+    "EMBED_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "embeddings.sqlite"),
+)
+
+_SQLITE_MAX_VARS = 900
+
+
+def text_key(model_name: str, text: str) -> bytes:
+    return hashlib.sha256(f"{model_name}\x00{text}".encode("utf-8")).digest()
+
+
+class EmbeddingStore:
+    def __init__(self, path: str = EMBED_CACHE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key BLOB PRIMARY KEY, dim INTEGER NOT NULL, vec BLOB NOT NULL"
+            ") WITHOUT ROWID"
+        )
+        self._conn.commit()
+
+    def get_many(self, keys: Sequence[bytes]) -> Dict[bytes, np.ndarray]:
+        found: Dict[bytes, np.ndarray] = {}
+        uniq = list(dict.fromkeys(keys))
+        with self._lock:
+            for i in range(0, len(uniq), _SQLITE_MAX_VARS):
+                part = uniq[i:i + _SQLITE_MAX_VARS]
+                rows = self._conn.execute(
+                    f"SELECT key, vec FROM embeddings WHERE key IN ({','.join('?' * len(part))})",
+                    part,
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    def put_many(self, items: Sequence[Tuple[bytes, np.ndarray]]) -> None:
+        rows = [(k, int(v.shape[0]), np.ascontiguousarray(v, dtype=np.float32).tobytes()) for k, v in items]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings (key, dim, vec) VALUES (?, ?, ?)", rows)
+            self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+_store: Optional[EmbeddingStore] = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> EmbeddingStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = EmbeddingStore()
+    return _store
+
+
+def embed_cached(
+    texts: List[str],
+    embed_fn: Callable[[List[str]], np.ndarray],
+    model_name: str,
+    store: Optional[EmbeddingStore] = None,
+) -> Tuple[np.ndarray, Dict[str, int]]:
+    """
+    Embed `texts` (2-D float32, input order), encoding only those whose
+    (model, text) hash is not in the store. Returns (vectors, {"hits", "misses"}).
+    """
+    store = store or get_store()
+    keys = [text_key(model_name, t) for t in texts]
+    cached = store.get_many(keys)
+
+    missing: Dict[bytes, str] = {}
+    for k, t in zip(keys, texts):
+        if k not in cached and k not in missing:
+            missing[k] = t
+    if missing:
+        fresh = embed_fn(list(missing.values()))
+        new_items = list(zip(missing.keys(), fresh))
+        store.put_many(new_items)
+        cached.update(new_items)
+
+    hits = sum(1 for k in keys if k not in missing)
+    if not texts:
+        return np.zeros((0, 0), dtype=np.float32), {"hits": 0, "misses": 0}
+    vectors = np.stack([cached[k] for k in keys]).astype(np.float32, copy=False)
+    return vectors, {"hits": hits, "misses": len(texts) - hits}
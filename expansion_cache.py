@@ -0,0 +1,130 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Any, Dict, Optional
+
+from metrics import register_cache
+
+# Durable cache of llm_expand_query results: key = sha256 of the canonical
+# (model, prompt version, user query, vibe info), value = the parsed JSON.
+# SQLite in WAL mode, so every API worker process shares one file.
+EXPANSION_CACHE_PATH = os.getenv(
+    "EXPANSION_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "expansions.sqlite"),
+)
+EXPANSION_CACHE_TTL_SECONDS = float(os.getenv("EXPANSION_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+EXPANSION_CACHE_MAX_ROWS = int(os.getenv("EXPANSION_CACHE_MAX_ROWS", "50000"))
+
+_PRUNE_EVERY = 256  # puts between size/TTL sweeps
+
+
+def _canonical_text(text: Any) -> str:
+    return " ".join(str(text or "").split()).casefold()
+
+
+def canonical_vibe_info(vibe_info: Any) -> Any:
+    # a list of vibe strings is an unordered set of hints
+    if isinstance(vibe_info, (list, tuple, set)):
+        return sorted({_canonical_text(v) for v in vibe_info if v})
+    return _canonical_text(vibe_info)
+
+
+def expansion_key(model: str, prompt_version: int, user_query: str, vibe_info: Any) -> bytes:
+    payload = json.dumps(
+        [model, prompt_version, _canonical_text(user_query), canonical_vibe_info(vibe_info)],
+        ensure_ascii=False, separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode("utf-8")).digest()
+
+
+class ExpansionStore:
+    def __init__(self, path: str = EXPANSION_CACHE_PATH,
+                 ttl_seconds: float = EXPANSION_CACHE_TTL_SECONDS,
+                 max_rows: int = EXPANSION_CACHE_MAX_ROWS):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_rows = max_rows
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._puts = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5.0)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS expansions ("
+            " key BLOB PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL"
+            ") WITHOUT ROWID"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS expansions_created ON expansions (created)")
+        self._conn.commit()
+
+    def get(self, key: bytes) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM expansions WHERE key = ? AND created >= ?",
+                (key, time.time() - self.ttl_seconds),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key: bytes, value: Dict) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO expansions (key, value, created) VALUES (?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), time.time()),
+            )
+            self._conn.commit()
+            self._puts += 1
+            if self._puts % _PRUNE_EVERY == 1:
+                self._prune()
+
+    def _prune(self) -> None:
+        # expired rows first, then the oldest rows beyond max_rows
+        self._conn.execute("DELETE FROM expansions WHERE created < ?", (time.time() - self.ttl_seconds,))
+        self._conn.execute(
+            "DELETE FROM expansions WHERE key IN ("
+            " SELECT key FROM expansions ORDER BY created DESC LIMIT -1 OFFSET ?)",
+            (self.max_rows,),
+        )
+        self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM expansions").fetchone()[0]
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "rows": len(self),
+            "max_rows": self.max_rows,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+_store: Optional[ExpansionStore] = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> ExpansionStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ExpansionStore()
+                register_cache("llm_expansion", _store.stats)
+    return _store
@@ -0,0 +1,277 @@
+import os
+import re
+import json
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from glossary_service import GLOSSARY_DIR, get_glossary
+
+# Deterministic parse of a shopping query into the JSON shape json_to_str
+# consumes (item, cuts, materials, colors, details, price, sizes, occasion,
+# season, vibe_definition), using the controlled vocabulary of the ontology.
+# Simple queries ("black cargo pants under 50") are expanded with one scan
+# over the words; the confidence score tells the caller when to ask the LLM.
+ONTOLOGY_PATH = os.path.join(GLOSSARY_DIR, "ontology.patched.json")
+
+# ---------- prices ----------
+_NUM = r"\$?\s*(\d+(?:\.\d+)?)\s*(?:usd|dollars?|bucks)?"
+_PRICE_RANGE = re.compile(rf"(?:between\s+)?{_NUM}\s*(?:-|–|to|and)\s*{_NUM}")
+_PRICE_MAX = re.compile(rf"(?:under|below|less than|up to|max(?:imum)?|at most|<=?|no more than)\s*{_NUM}")
+_PRICE_MIN = re.compile(rf"(?:over|above|more than|at least|min(?:imum)?|>=?|from)\s*{_NUM}|{_NUM}\s*\+")
+
+def parse_price_range(price: Any) -> Tuple[Optional[float], Optional[float]]:
+    """
+    "under 150" -> (None, 150.0), "$50-100" -> (50.0, 100.0), "over 40" -> (40.0, None).
+    Anything else ("budget", "cheap") -> (None, None).
+    """
+    text = str(price or "").lower()
+    m = _PRICE_RANGE.search(text)
+    if m:
+        lo, hi = sorted((float(m.group(1)), float(m.group(2))))
+        return lo, hi
+    m = _PRICE_MAX.search(text)
+    if m:
+        return None, float(m.group(1))
+    m = _PRICE_MIN.search(text)
+    if m:
+        return float(m.group(1) or m.group(2)), None
+    return None, None
+
+# on raw query text a number is only a price with a cue: "jeans size 28-30",
+# "jeans from 2003" and "tees 30+" are not prices, "$30+" and "under 50" are
+_PRICE_BETWEEN = re.compile(rf"between\s+{_NUM}\s*(?:-|–|to|and)\s*{_NUM}")
+_PRICE_ABOVE = re.compile(rf"(?:over|above|more than|at least|min(?:imum)?|>=?)\s*{_NUM}")
+_PRICE_FROM = re.compile(rf"from\s*{_NUM}|{_NUM}\s*\+")
+_CURRENCY = re.compile(r"\$|\b(?:usd|dollars?|bucks)\b")
+_PRICE_WORD = re.compile(r"\b(?:price[ds]?|pricing|budget|costs?|spend)\b")
+
+def _find_price(text: str) -> Tuple[Optional[re.Match], bool]:
+    """
+    (match, cued) for the price expression in a query. Bare ranges and
+    "from N" / "N+" need a currency or a price word; "over N" without one is
+    returned with cued=False so the caller can lower its confidence.
+    """
+    price_word = bool(_PRICE_WORD.search(text))
+
+    def cued(m: re.Match) -> bool:
+        return price_word or bool(_CURRENCY.search(m.group(0)))
+
+    m = _PRICE_BETWEEN.search(text) or _PRICE_MAX.search(text)
+    if m:
+        return m, True
+    m = _PRICE_RANGE.search(text)
+    if m and cued(m):
+        return m, True
+    m = _PRICE_ABOVE.search(text)
+    if m:
+        return m, cued(m)
+    m = _PRICE_FROM.search(text)
+    if m and cued(m):
+        return m, True
+    return None, False
+
+
+# ---------- vocabulary ----------
+# facet name in the ontology -> key in the expanded query
+_FACETS = (
+    ("items", "item"), ("cuts", "cuts"), ("materials", "materials"), ("colors", "colors"),
+    ("details", "details"), ("occasion", "occasion"), ("season", "season"),
+    ("price_band", "price"), ("vibes", "vibe"),
+)
+
+# everyday spellings of ontology terms
+_SYNONYMS = {
+    "items": {
+        "T-Shirt": ["tee", "t shirt", "tshirt", "baby tee", "graphic tee"],
+        "Hoodie": ["hoody", "zip up", "zip-up"],
+        "Tank Top": ["tank", "tank top"],
+        "Cargo Pants": ["cargos", "cargo"],
+        "Sweatpants": ["sweats"],
+        "Button-Up Shirt": ["button down", "button-down", "button up"],
+        "Longsleeve Top": ["long sleeve", "long-sleeve", "longsleeve"],
+        "Puffer Coat": ["puffer", "puffer jacket"],
+        "Trench Coat": ["trench"],
+        "Jeans": ["jean", "denim pants"],
+        "Trousers": ["pants", "slacks"],
+        "Camisole": ["cami"],
+    },
+    "colors": {"grey": ["gray"], "navy": ["navy blue"]},
+    "cuts": {"form-fitting": ["form fitting", "bodycon", "tight"], "cropped": ["crop", "crop top"]},
+    "season": {"fall": ["autumn"]},
+    "price_band": {
+        "budget": ["cheap", "affordable", "inexpensive", "budget friendly"],
+        "mid": ["mid range", "mid-range", "mid priced"],
+        "premium": ["high end", "high-end", "designer", "expensive"],
+    },
+}
+# colors the catalog uses that the ontology list lacks
+_EXTRA = {"colors": ["pink", "brown", "olive", "maroon"]}
+
+# words that carry no facet information
+_FILLER = {
+    "a", "an", "the", "some", "any", "and", "or", "with", "in", "for", "to", "of", "on", "my", "me", "i",
+    "im", "i'm", "want", "wanna", "need", "looking", "look", "find", "show", "get", "buy", "give",
+    "please", "pls", "something", "anything", "stuff", "clothes", "clothing", "outfit", "outfits",
+    "piece", "pieces", "pair", "pairs", "like", "that", "is", "are", "be", "would", "can", "you",
+    "have", "do", "does", "what", "wear", "style", "styled", "vibe", "vibes", "aesthetic", "core", "ish",
+    "good", "nice", "cute", "new", "size", "sized", "sizes", "fit", "fits", "color", "colored",
+    "price", "priced", "prices", "pricing", "cost", "costs", "spend",
+}
+_NEGATION = re.compile(r"\b(?:not|no|without|except|isn't|aren't|don't|never|avoid)\b")
+_WORD = re.compile(r"[a-z0-9$'][a-z0-9$'.]*")
+_SIZE = re.compile(
+    r"\bsize[sd]?\s+(\d{1,2})\s*(?:-|–|to)\s*(\d{1,2})\b"  # waist range: "size 28-30"
+    r"|\bsize\s+(xxs|xs|s|m|l|xl|xxl|xxxl|small|medium|large|\d{1,2})\b"
+    r"|\b(xxs|xs|xl|xxl|xxxl)\b"
+    r"|\bin (?:a )?(small|medium|large)\b"
+)
+_SIZE_WORDS = {"small": "S", "medium": "M", "large": "L"}
+_VIBE_TEXT = re.compile(r"^Vibe:\s*(.+?)\.\s*Definition:")
+_TERM_TOKEN = re.compile(r"[a-z0-9$']+")  # spaces and hyphens both separate ("t-shirt" == "t shirt")
+
+
+class FacetExtractor:
+    """
+    Every alias in the ontology (plus plurals) in one dict keyed by its
+    words; the query is scanned left to right taking the longest alias at
+    each word, so "cargo pants" wins over "cargo". extract() returns the
+    expanded query and a confidence in [0, 1]: the share of meaningful
+    query words that were recognized.
+    """
+
+    def __init__(self, ontology: Dict[str, List[str]], glossary: Dict[str, Dict]):
+        self.glossary = glossary
+        self._alias: Dict[Tuple[str, ...], Tuple[str, str]] = {}  # alias words -> (output key, canonical value)
+        for facet, key in _FACETS:
+            terms = [(t, t) for t in list(ontology.get(facet, [])) + _EXTRA.get(facet, [])]
+            if facet == "vibes":
+                terms += [(v, v) for v in glossary]
+            terms += [(alias, term) for term, aliases in _SYNONYMS.get(facet, {}).items() for alias in aliases]
+            for alias, term in terms:
+                words = tuple(_TERM_TOKEN.findall(alias.lower()))
+                if words:
+                    self._alias.setdefault(words, (key, term))
+        # plurals only where they do not shadow a real term ("dresses", "tees")
+        for words, value in list(self._alias.items()):
+            for suffix in ("s", "es"):
+                self._alias.setdefault(words[:-1] + (words[-1] + suffix,), value)
+        self._max_words = max((len(w) for w in self._alias), default=1)
+
+    def _scan(self, text: str, skip: List[Tuple[int, int]]) -> List[Tuple[str, str, Tuple[int, int]]]:
+        """(output key, canonical value, span) for the longest alias at each word, left to right."""
+        tokens = [(m.group(0), m.start(), m.end()) for m in _TERM_TOKEN.finditer(text)
+                  if not any(s <= m.start() < e for s, e in skip)]
+        out, i = [], 0
+        while i < len(tokens):
+            for n in range(min(self._max_words, len(tokens) - i), 0, -1):
+                hit = self._alias.get(tuple(t[0] for t in tokens[i:i + n]))
+                if hit:
+                    out.append((hit[0], hit[1], (tokens[i][1], tokens[i + n - 1][2])))
+                    i += n
+                    break
+            else:
+                i += 1
+        return out
+
+    def _vibes_from_info(self, vibe_info: Any) -> Tuple[List[str], bool]:
+        """Glossary vibes named in vibe_info strings; False if some string was not understood."""
+        vibes, understood = [], True
+        for text in ([vibe_info] if isinstance(vibe_info, str) else (vibe_info or [])):
+            if not text:
+                continue
+            m = _VIBE_TEXT.match(text)
+            vibe = m.group(1).lower() if m else None
+            if vibe in self.glossary:
+                vibes.append(vibe)
+            else:
+                understood = False
+        return vibes, understood
+
+    def extract(self, user_query: str, vibe_info: Any = None) -> Tuple[Dict[str, Any], float]:
+        text = " ".join((user_query or "").lower().split())
+        found: Dict[str, List[str]] = {}
+        covered: List[Tuple[int, int]] = []
+
+        def add(key: str, value: str):
+            values = found.setdefault(key, [])
+            if value not in values:
+                values.append(value)
+
+        # sizes first: their numbers ("size 28-30") must not read as a price
+        for m in _SIZE.finditer(text):
+            if m.group(1):
+                lo, hi = sorted((int(m.group(1)), int(m.group(2))))
+                for n in range(lo, min(hi, lo + 20) + 1):
+                    add("sizes", str(n))
+            else:
+                size = next(g for g in m.groups() if g)
+                add("sizes", _SIZE_WORDS.get(size, size.upper()))
+            covered.append(m.span())
+        masked = text
+        for start, end in covered:
+            masked = masked[:start] + " " * (end - start) + masked[end:]
+        price, price_cued = _find_price(masked)
+        if price:
+            found["price"] = [price.group(0).strip()]
+            covered.append(price.span())
+        for key, value, span in self._scan(text, covered):
+            if key == "price" and "price" in found:
+                continue
+            add(key, value)
+            covered.append(span)
+
+        vibes, understood = self._vibes_from_info(vibe_info)
+        for vibe in found.pop("vibe", []):
+            if vibe.lower() in self.glossary and vibe.lower() not in vibes:
+                vibes.append(vibe.lower())
+
+        out: Dict[str, Any] = {}
+        items = found.get("item") or []
+        if not items:
+            # no item asked for: fall back to the items of the vibe(s)
+            for vibe in vibes:
+                items += [i for i in self.glossary[vibe].get("items", []) if i not in items]
+        if items:
+            out["item"] = items[0] if len(items) == 1 else items
+        for key in ("materials", "cuts", "colors", "details"):
+            values = list(found.get(key, []))
+            for vibe in vibes:
+                values += [v for v in self.glossary[vibe].get(key, []) if v not in values]
+            if values:
+                out[key] = values
+        if "sizes" in found:
+            out["sizes"] = found["sizes"]
+        for key in ("occasion", "season", "price"):
+            if key in found:
+                out[key] = found[key][0]
+        if vibes:
+            out["vibe_definition"] = " ".join(self.glossary[v].get("definition", "") for v in vibes).strip()
+
+        words = [(m.start(), m.group(0).strip(".")) for m in _WORD.finditer(text)]
+        content = [(pos, w) for pos, w in words if w not in _FILLER]
+        known = sum(1 for pos, _ in content if any(s <= pos < e for s, e in covered))
+        confidence = known / len(content) if content else 0.0
+        if not items:
+            confidence *= 0.5  # nothing to anchor the search on
+        if price and not price_cued:
+            confidence = min(confidence, 0.5)  # "over 40": a price, or an age/year?
+        if not understood or _NEGATION.search(text):
+            confidence = min(confidence, 0.3)  # vibe text / negations need the LLM
+        return out, round(confidence, 3)
+
+
+_extractor: Optional[FacetExtractor] = None
+_extractor_lock = threading.Lock()
+
+def get_extractor() -> FacetExtractor:
+    global _extractor
+    if _extractor is None:
+        with _extractor_lock:
+            if _extractor is None:
+                with open(ONTOLOGY_PATH, "r", encoding="utf-8") as f:
+                    ontology = json.load(f)
+                _extractor = FacetExtractor(ontology, get_glossary())
+    return _extractor
+
+def extract_facets(user_query: str, vibe_info: Any = None) -> Tuple[Dict[str, Any], float]:
+    return get_extractor().extract(user_query, vibe_info)
@@ -1,77 +1,308 @@
 from __future__ import annotations
-from collections import deque
-from typing import Any, Deque, Dict, Optional, Literal
+from typing import Any, AsyncIterator, Dict, List, Optional, Literal
 
 import asyncio
-from fastapi import FastAPI, HTTPException
+import json
+import logging
+import time
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel, Field
 
 # ---- your agent code ----
-from agent import run_agent_turn
+from agent import run_agent_turn_async, stream_agent_turn, tool_executor
+from agent_utils import expansion_stats, search_pipeline
+import db_upload
+import glossary_service
+from vector_backend import collection_version, get_backend
+from session_store import SessionStore
+from context_budget import products_shown_message
+from expansion_cache import get_store as get_expansion_store
+from metrics import REGISTRY, bind_context, configure_logging, new_trace_id, request_seconds
+
+configure_logging()
+logger = logging.getLogger("tailord.api")
 
 # ---------- config ----------
 MAX_TURNS = 60
+MAX_SESSIONS = 1000
+SESSION_TTL_SECONDS = 60 * 60
+DEFAULT_CTX = {"gender": "Male", "age": 30}  # static context for this example
 BASE_SYSTEM_PROMPT = (
         "You help users find outfits from the store’s catalog.\n\n"
-        "When the user mentions pop-culture fashion slang (e.g., 'indie', 'blokette', 'goth'), first call "
-        "`glossary_lookup` with the phrase to obtain canonical tags.\n"
-        "Assemble a normalized search query by calling the `query_to_search_str` tool, passing "
-        "raw user query and the response from the glossary lookup tool. "
-        "You must wait for the glossary lookup tool to return before calling the query_to_search_str tool\n"
-        "Next, call `catalog_search` with search string and wait for it to return a list of products.\n\n"
-        "Finally, present a grounded, neutral recommendation based ONLY on the returned products. "
+        "To find products, call `find_products` once with the user's request as `query`, any vibe or "
+        "pop-culture slang phrases (e.g., 'indie', 'blokette', 'goth') as `vibe_terms`, and any explicit price "
+        "or size limits. It looks up the vibes, builds the search and returns products plus the vibe definitions used.\n"
+        "Only call `glossary_lookup` when the user asks what a term means without wanting products.\n\n"
+        "Then present a grounded, neutral recommendation based ONLY on the returned products. "
         "Keep it concise, warm, and fashion-aware. Briefly mention how the items fit the vibe. \n"
         "Do not imply the user chose any item; avoid phrases like 'nice choice'. "
         "Cite details strictly from the product JSON (name, brand, price, color, material). "
         "If no results are suitable, ask a brief, specific follow-up (e.g., price or color)."
     )
 
-# ---------- single active session state ----------
-_messages: Deque[Dict[str, Any]] = deque(maxlen=MAX_TURNS)
-_lock = asyncio.Lock()  # avoid races under concurrent requests
-_ctx = {"gender": "Male", "age": 30}  # static context for this example
+# ---------- session state ----------
+# one history/ctx/lock per session; turns only serialize within a session
+_sessions = SessionStore(
+    max_turns=MAX_TURNS,
+    max_sessions=MAX_SESSIONS,
+    ttl_seconds=SESSION_TTL_SECONDS,
+    default_ctx=DEFAULT_CTX,
+)
+
 # ---------- models ----------
 class ChatRequest(BaseModel):
     message: str = Field(..., min_length=1)
+    session_id: Optional[str] = Field(None, max_length=128)  # omitted -> a new session is started
+    ctx: Optional[Dict[str, Any]] = None  # e.g. {"gender": "Female", "age": 25}; merged into the session ctx
     reset: bool = False
 
 
 class ChatResponse(BaseModel):
     reply: str
     turns: int
+    session_id: str
+
+
+class SearchRequest(BaseModel):
+    query: str = Field(..., min_length=1)
+    vibe_terms: Optional[List[str]] = None  # defaults to the query itself
+    top_k: int = Field(10, ge=1, le=100)
+    only_in_stock: bool = True
+    # explicit filters from the UI; override anything parsed from the query
+    price_min: Optional[float] = Field(None, ge=0)
+    price_max: Optional[float] = Field(None, ge=0)
+    product_types: Optional[List[str]] = None
+    sizes: Optional[List[str]] = None
+
+
+class ProductHit(BaseModel):
+    score: float
+    id: int
+    title: str
+    product_type: str
+    in_stock: bool
+    sizes_in_stock: List[str]
+    handle: str
+    price_min: Optional[float] = None
+    price_max: Optional[float] = None
+
+
+class SearchResponse(BaseModel):
+    query: str
+    search_str: str
+    vibe_info: List[str]
+    filters: Dict[str, Any]
+    results: List[ProductHit]
+
+
+# ---------- warmup / readiness ----------
+# Nothing heavy happens at import. Startup kicks off warmup in the background
+# so the process can answer /ready (503 until loaded) while the model loads.
+_readiness: Dict[str, Any] = {"model": False, "glossary": False, "collections": False, "errors": {}}
+
+
+def _load_collections() -> None:
+    get_backend().load(db_upload.COLLECTION_NAME)
+
+
+def _warmup() -> None:
+    steps = (
+        ("glossary", glossary_service.get_glossary_index),
+        ("model", db_upload.warmup),
+        ("collections", _load_collections),
+    )
+    for name, step in steps:
+        try:
+            step()
+            _readiness[name] = True
+        except Exception as e:
+            _readiness["errors"][name] = str(e)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    loop = asyncio.get_running_loop()
+    warmup_task = loop.run_in_executor(tool_executor, _warmup)
+    yield
+    warmup_task.cancel()
+    get_backend().close()
 
 
 # ---------- app ----------
-app = FastAPI(title="Tailord Chat API (single-session)")
+app = FastAPI(title="Tailord Chat API", lifespan=lifespan)
+
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    # one trace id per request (X-Request-ID if the caller sent one), on every log line
+    trace_id = new_trace_id(request.headers.get("x-request-id"))
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        route = request.scope.get("route")
+        request_seconds.observe(
+            time.perf_counter() - start,
+            method=request.method,
+            path=getattr(route, "path", "unmatched"),  # templates keep label cardinality bounded
+            status=str(status),
+        )
+    response.headers["X-Request-ID"] = trace_id
+    return response
+
+
+@app.get("/metrics")
+async def metrics() -> PlainTextResponse:
+    """Prometheus text exposition of this worker's histograms, counters and cache stats."""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/ready")
+async def ready() -> JSONResponse:
+    body = {
+        "ready": _readiness["model"] and _readiness["glossary"] and _readiness["collections"],
+        "model": db_upload.model_loaded(),
+        "glossary": glossary_service.glossary_index_loaded(),
+        "collections": get_backend().loaded(),
+        "errors": _readiness["errors"],
+    }
+    return JSONResponse(body, status_code=200 if body["ready"] else 503)
+
+@app.get("/stats")
+async def stats() -> Dict[str, Any]:
+    return {
+        "catalog_version": collection_version(db_upload.COLLECTION_NAME),
+        "search_cache": db_upload.result_cache.stats(),
+        "query_embed_cache": db_upload.query_cache.stats(),
+        "expansion_cache": get_expansion_store().stats(),
+        "expansions": dict(expansion_stats),
+    }
+
 
 @app.post("/chat", response_model=ChatResponse)
 async def chat(req: ChatRequest) -> ChatResponse:
-    async with _lock:
-        global _messages, _ctx
-
-        # optional reset of the single session
+    session = _sessions.get_or_create(req.session_id)
+    async with session.lock:
+        # optional reset of this session only
         if req.reset:
-            _messages.clear()
+            session.messages.clear()
+        if req.ctx:
+            session.ctx.update(req.ctx)
 
         # add user turn
-        _messages.append({"role": "user", "content": req.message})
+        session.messages.append({"role": "user", "content": req.message})
 
-        # run one assistant turn; pass a copy of messages
+        # run one assistant turn on the event loop; pass a copy of messages
+        shown: List[str] = []
         try:
-            reply = run_agent_turn(
-                messages=list(_messages),
+            reply = await run_agent_turn_async(
+                messages=list(session.messages),
                 base_system_prompt=BASE_SYSTEM_PROMPT,
-                ctx=_ctx,
+                ctx=dict(session.ctx),
+                shown=shown,
             )
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"agent_error: {e!s}")
 
-        # persist the assistant turn in our single history
-        _messages.append({"role": "assistant", "content": reply})
-        print(_messages)
-        
+        # persist the assistant turn in this session's history, with a digest
+        # of the products it was grounded on (not the raw tool JSON)
+        if shown:
+            session.messages.append(products_shown_message(shown))
+        session.messages.append({"role": "assistant", "content": reply})
+        logger.debug("session %s now has %d messages", session.session_id, len(session.messages))
+
         return ChatResponse(
             reply=reply,
-            turns=sum(1 for m in _messages if m["role"] in ("user", "assistant")),
+            turns=sum(1 for m in session.messages if m["role"] in ("user", "assistant")),
+            session_id=session.session_id,
         )
         
+
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.post("/chat/stream")
+async def chat_stream(req: ChatRequest) -> StreamingResponse:
+    """
+    Server-Sent Events version of /chat. Emits `session` immediately, then
+    `progress` events while tools run, `token` events for the final answer,
+    and a closing `done` event with the full reply and turn count.
+    """
+    session = _sessions.get_or_create(req.session_id)
+
+    async def events() -> AsyncIterator[str]:
+        async with session.lock:
+            if req.reset:
+                session.messages.clear()
+            if req.ctx:
+                session.ctx.update(req.ctx)
+            session.messages.append({"role": "user", "content": req.message})
+            yield _sse("session", {"session_id": session.session_id})
+
+            reply = None
+            shown: List[str] = []
+            try:
+                async for ev in stream_agent_turn(
+                    messages=list(session.messages),
+                    base_system_prompt=BASE_SYSTEM_PROMPT,
+                    ctx=dict(session.ctx),
+                    shown=shown,
+                ):
+                    if ev["type"] == "done":
+                        reply = ev["reply"]
+                    else:
+                        yield _sse(ev["type"], ev)
+            except Exception as e:
+                yield _sse("error", {"detail": f"agent_error: {e!s}"})
+                return
+
+            # persist only once the reply is complete
+            if shown:
+                session.messages.append(products_shown_message(shown))
+            session.messages.append({"role": "assistant", "content": reply})
+            yield _sse("done", {
+                "reply": reply,
+                "turns": sum(1 for m in session.messages if m["role"] in ("user", "assistant")),
+                "session_id": session.session_id,
+            })
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.post("/search", response_model=SearchResponse)
+async def search(req: SearchRequest) -> SearchResponse:
+    """
+    Structured product search for grid/filter UIs: runs the retrieval
+    pipeline directly, without the chat orchestrator or a written reply.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        out = await loop.run_in_executor(
+            tool_executor,
+            bind_context(
+                search_pipeline,
+                req.query,
+                vibe_terms=req.vibe_terms,
+                top_k=req.top_k,
+                only_in_stock=req.only_in_stock,
+                filters={
+                    "price_min": req.price_min,
+                    "price_max": req.price_max,
+                    "product_types": req.product_types,
+                    "sizes": req.sizes,
+                },
+            ),
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"search_error: {e!s}")
+    return SearchResponse(**out)
@@ -1,99 +1,271 @@
 import json
-from typing import Dict, List
-from pymilvus import connections, FieldSchema, CollectionSchema, DataType, Collection, utility
-from db_upload import as_float32_list, embed
+import logging
+import os
+import re
+import glob
+import difflib
+import hashlib
+import tempfile
+import threading
+from typing import Dict, List, Optional
+import numpy as np
+from db_upload import MODEL_NAME, embed_query, embed_with_cache
+from vector_backend import get_backend
+from metrics import stage
 
-COLLECTION_NAME = "style_glossary"
+logger = logging.getLogger("tailord.glossary")
 
-GLOSSARY = {}
-with open("glossary/glossary_normalized.jsonl") as f:
-    for line in f:
+# v2: id/vector/metadata layout shared by every vector backend
+COLLECTION_NAME = "style_glossary_v2"
+GLOSSARY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "glossary")
+GLOSSARY_PATH = os.path.join(GLOSSARY_DIR, "glossary_normalized.jsonl")
+# where the persisted glossary embeddings live (scratch dirs in benchmarks/tests)
+GLOSSARY_INDEX_DIR = os.getenv("GLOSSARY_INDEX_DIR", GLOSSARY_DIR)
+# bump when glossary_text() changes so persisted embeddings are rebuilt
+GLOSSARY_TEXT_VERSION = 1
+
+def load_glossary(path: str = GLOSSARY_PATH) -> Dict[str, Dict]:
+    glossary = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
             try:
                 # Parse each line as a JSON object
                 json_object = json.loads(line.strip())
                 json_list = list(json_object.items())[1:]
                 vibe = json_object.get("vibe", "").lower()
-                GLOSSARY[vibe] = dict(json_list)
+                glossary[vibe] = dict(json_list)
             except json.JSONDecodeError as e:
-                print(f"Error decoding JSON on line: {line.strip()}. Error: {e}")
+                logger.warning("Error decoding JSON on line: %s. Error: %s", line.strip(), e)
                 # You might choose to skip the faulty line or handle it differently
                 continue
+    return glossary
+
+# parsed on first use rather than at import
+_glossary = None
+_glossary_lock = threading.Lock()
+
+def get_glossary() -> Dict[str, Dict]:
+    global _glossary
+    if _glossary is None:
+        with _glossary_lock:
+            if _glossary is None:
+                _glossary = load_glossary()
+    return _glossary
+
+def glossary_loaded() -> bool:
+    return _glossary is not None
+
+def __getattr__(name):
+    # keep `glossary_service.GLOSSARY` working for existing callers
+    if name == "GLOSSARY":
+        return get_glossary()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def glossary_text(vibe: str, entry: Dict) -> str:
+    definition = entry.get("definition", "")
+    items = entry.get("items", [])
+    cuts = entry.get("cuts", [])
+    materials = entry.get("materials", [])
+    return f"Vibe: {vibe}. Definition: {definition} Items: {', '.join(items)}. Cuts: {', '.join(cuts)}. Materials: {', '.join(materials)}"
 
 def build_glossary_texts(glossary: List[Dict]) -> List[str]:
     texts = []
     for vibe in glossary:
-        definition = glossary[vibe].get("definition", "")
-        items = glossary[vibe].get("items", [])
-        cuts = glossary[vibe].get("cuts", [])
-        materials = glossary[vibe].get("materials", [])
-        text = f"Vibe: {vibe}. Definition: {definition} Items: {', '.join(items)}. Cuts: {', '.join(cuts)}. Materials: {', '.join(materials)}"
-        texts.append(text)
+        texts.append(glossary_text(vibe, glossary[vibe]))
     return texts
 
+
+# ---------- in-process name matcher ----------
+_NON_ALNUM = re.compile(r"[^a-z0-9]+")
+# vibe names too generic to trigger on their own inside a longer phrase
+_PHRASE_STOPWORDS = {"core"}
+
+def compact_term(term: str) -> str:
+    # "Goth-Core" / "goth core" -> "gothcore", "A$AP Rocky" / "asap rocky" -> "asaprocky"
+    return _NON_ALNUM.sub("", (term or "").lower().replace("$", "s"))
+
+def _term_words(term: str) -> List[str]:
+    return [w for w in _NON_ALNUM.split((term or "").lower().replace("$", "s")) if w]
+
+class GlossaryMatcher:
+    """
+    Resolves a term to a glossary vibe without touching the vector store:
+    exact alias hit, then difflib fuzzy matching on compacted names, then
+    the longest alias found inside the phrase. Returns None when nothing is
+    close enough, so the caller can fall back to vector search.
+    """
+
+    def __init__(self, glossary: Dict[str, Dict], fuzzy_cutoff: float = 0.85):
+        self.glossary = glossary
+        self.fuzzy_cutoff = fuzzy_cutoff
+        self.aliases: Dict[str, str] = {}
+        for vibe in glossary:
+            for alias in self._aliases_for(vibe):
+                self.aliases.setdefault(alias, vibe)
+        self.max_words = max((len(_term_words(v)) for v in glossary), default=1)
+        self._fuzzy_keys = [a for a in self.aliases if len(a) >= 4]
+
+    @staticmethod
+    def _aliases_for(vibe: str) -> List[str]:
+        key = compact_term(vibe)
+        aliases = [key]
+        # "goth core" is also asked for as just "goth"
+        if key.endswith("core") and len(key) > len("core") + 2:
+            aliases.append(key[: -len("core")])
+        # "90s" <-> "1990s"
+        if re.fullmatch(r"[0-9]0s", key):
+            aliases.append("19" + key)
+        return aliases
+
+    def _hit(self, vibe: str, score: float, match: str) -> Dict:
+        return {
+            "vibe": vibe,
+            "text": glossary_text(vibe, self.glossary[vibe]),
+            "score": score,
+            "match": match,
+        }
+
+    def match(self, term: str) -> Optional[Dict]:
+        key = compact_term(term)
+        if not key:
+            return None
+        vibe = self.aliases.get(key)
+        if vibe:
+            return self._hit(vibe, 1.0, "exact")
+
+        if len(key) >= 4:
+            close = difflib.get_close_matches(key, self._fuzzy_keys, n=1, cutoff=self.fuzzy_cutoff)
+            if close:
+                ratio = difflib.SequenceMatcher(None, key, close[0]).ratio()
+                return self._hit(self.aliases[close[0]], ratio, "fuzzy")
+
+        # longest alias contained in the phrase, e.g. "y2k baby tee" -> y2k
+        words = _term_words(term)
+        for n in range(min(self.max_words, len(words)), 0, -1):
+            for i in range(len(words) - n + 1):
+                piece = "".join(words[i:i + n])
+                vibe = self.aliases.get(piece)
+                if vibe and piece not in _PHRASE_STOPWORDS:
+                    return self._hit(vibe, 0.95, "phrase")
+        return None
+
+_matcher = None
+_matcher_lock = threading.Lock()
+
+def get_matcher() -> GlossaryMatcher:
+    global _matcher
+    if _matcher is None:
+        with _matcher_lock:
+            if _matcher is None:
+                _matcher = GlossaryMatcher(get_glossary())
+    return _matcher
+
+def match_glossary(term: str) -> Optional[Dict]:
+    return get_matcher().match(term)
+
 def ingest_glossary(glossary: List[Dict]):
-    
-    # 2) embed
+    """
+    Mirror the glossary into the configured vector backend. search_glossary
+    itself reads the local .npy index and does not need this.
+    """
+    # 2) embed (only texts not already in the on-disk cache are encoded)
     texts = build_glossary_texts(glossary)
-    vectors = embed(texts)
-    # 3) connect + create collection
-    connections.connect(alias="default", host="127.0.0.1", port="19530")
-    dim = len(vectors[0])
-    if not utility.has_collection(COLLECTION_NAME):
-        fields = [
-            FieldSchema(name="id", dtype=DataType.INT64, is_primary=True, auto_id=True),
-            FieldSchema(name="text", dtype=DataType.VARCHAR, max_length=512),
-            FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, dim=dim),
-        ]
-        schema = CollectionSchema(fields, description="Glossary vibe embeddings")
-        collection = Collection(name=COLLECTION_NAME, schema=schema)
-    else:
-        collection = Collection(name=COLLECTION_NAME)
-    
-    collection.create_index(
-        field_name="embedding",
-        index_params={
-            "index_type": "HNSW",
-            "metric_type": "IP",
-            "params": {"M": 16, "efConstruction": 200}
-        }
-    )
+    vectors, stats = embed_with_cache(texts)
+    logger.info("glossary embeddings: %d/%d from cache", stats["hits"], len(texts))
+    # 3) create collection + upsert (ids are stable per vibe, so reruns replace rows)
+    backend = get_backend()
+    backend.ensure(COLLECTION_NAME, dim=vectors.shape[1])
+    rows = [
+        {"id": int(hashlib.sha1(vibe.encode("utf-8")).hexdigest()[:15], 16),
+         "vector": vec, "metadata": {"vibe": vibe, "text": text}}
+        for vibe, text, vec in zip(glossary, texts, vectors)
+    ]
+    backend.insert(COLLECTION_NAME, rows)
+    backend.flush(COLLECTION_NAME)
 
-    collection.insert([texts, vectors])
-    collection.flush()
-    
-   
-def search_glossary(query: str, top_k: int = 3) -> List[Dict]:
+
+# ---------- in-process vector index ----------
+class GlossaryIndex:
     """
-    Search the glossary collection in Milvus for the closest vibes/items.
-    Returns a list of dicts with text + score.
+    Glossary embeddings held in a memory-mapped .npy matrix (one row per
+    build_glossary_texts entry); a lookup is one matrix-vector product.
     """
-    if not connections.has_connection("default"):
-        connections.connect(alias="default", host="127.0.0.1", port="19530")
-    collection = Collection(COLLECTION_NAME)
-    collection.load()
 
-    emb = embed(query)
-    qvec = as_float32_list(emb)
+    def __init__(self, texts: List[str], vectors: np.ndarray):
+        self.texts = texts
+        self.vectors = vectors
+
+    def search(self, qvec: np.ndarray, top_k: int = 3) -> List[Dict]:
+        scores = self.vectors @ qvec
+        k = min(top_k, len(scores))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [{"text": self.texts[i], "score": float(scores[i])} for i in top]
+
+def glossary_index_path(path: str = GLOSSARY_PATH) -> str:
+    # versioned by JSONL content, embedding model and text format
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        h.update(f.read())
+    h.update(f"|{MODEL_NAME}|{GLOSSARY_TEXT_VERSION}".encode())
+    return os.path.join(GLOSSARY_INDEX_DIR, f"glossary_embeddings.{h.hexdigest()[:16]}.npy")
+
+def build_glossary_index(path: str = GLOSSARY_PATH) -> GlossaryIndex:
+    texts = build_glossary_texts(get_glossary())
+    index_path = glossary_index_path(path)
+    if not os.path.exists(index_path):
+        vectors, _ = embed_with_cache(texts)
+        # every worker may build at once on first boot: each writes its own
+        # temp file, and whichever replace lands last publishes the same bytes
+        os.makedirs(GLOSSARY_INDEX_DIR, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=GLOSSARY_INDEX_DIR, prefix="glossary_embeddings.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, vectors)
+            os.replace(tmp_path, index_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        # drop embeddings of older glossary versions (another worker may beat us to it)
+        for old in glob.glob(os.path.join(GLOSSARY_INDEX_DIR, "glossary_embeddings.*.npy")):
+            if old != index_path:
+                try:
+                    os.remove(old)
+                except FileNotFoundError:
+                    pass
+    vectors = np.load(index_path, mmap_mode="r")
+    if vectors.shape[0] != len(texts):
+        raise ValueError(f"{index_path} has {vectors.shape[0]} rows, expected {len(texts)}")
+    return GlossaryIndex(texts, vectors)
+
+_index = None
+_index_lock = threading.Lock()
 
-    results = collection.search(
-        data=[qvec],
-        anns_field="embedding",
-        param={"metric_type": "IP", "params": {"ef": 64}},
-        limit=top_k,
-        output_fields=["text"]
-    )
+def get_glossary_index() -> GlossaryIndex:
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = build_glossary_index()
+    return _index
 
-    matches = []
-    for hit in results[0]:
-        matches.append({
-            "text": hit.entity.get("text"),
-            "score": hit.score
-        })
+def glossary_index_loaded() -> bool:
+    return _index is not None
 
-    return matches
+def search_glossary(query: str, top_k: int = 3) -> List[Dict]:
+    """
+    Search the in-process glossary index for the closest vibes/items.
+    Returns a list of dicts with text + score.
+    """
+    qvec = embed_query(query)
+    with stage("glossary_search"):
+        return get_glossary_index().search(qvec, top_k)
 
 
 
-#ingest_glossary(GLOSSARY)
+#ingest_glossary(get_glossary())
 
 # drop index on the vector field
@@ -0,0 +1,259 @@
+import os
+import re
+import json
+import math
+import tempfile
+import threading
+from collections import Counter, defaultdict
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# In-process BM25 over transform_product's search_text. Exact tokens such as
+# "affliction", "selvedge" or "cargo" are matched literally here, which the
+# MiniLM embedding tends to blur; search_catalog fuses both rankings.
+
+_TOKEN = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+_STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "in", "is", "it",
+    "of", "on", "or", "that", "the", "this", "to", "with",
+    # field labels from transform_product's search_text
+    "price", "min", "max", "none", "sizes", "stock", "tags", "features",
+}
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in _TOKEN.findall((text or "").lower()) if t not in _STOPWORDS and len(t) > 1]
+
+
+class BM25Index:
+    """
+    Okapi BM25 over per-document term frequencies. Each document keeps a
+    compact record (the fields search results and filters need), so lexical
+    hits can be returned without a round trip to the vector store.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.ids: List[int] = []
+        self.records: List[Dict] = []
+        self.tfs: List[Dict[str, int]] = []
+        self._pos: Dict[int, int] = {}
+        self._postings: Dict[str, List[Tuple[int, int]]] = {}
+        self._idf: Dict[str, float] = {}
+        self._doc_len: List[int] = []
+        self._avgdl = 0.0
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def add(self, doc_id: int, text: str, record: Dict) -> None:
+        # re-adding an id replaces the document; call finalize() before searching
+        self._add_tf(doc_id, record, dict(Counter(tokenize(text))))
+
+    def _add_tf(self, doc_id: int, record: Dict, tf: Dict[str, int]) -> None:
+        pos = self._pos.get(doc_id)
+        if pos is None:
+            self._pos[doc_id] = len(self.ids)
+            self.ids.append(doc_id)
+            self.records.append(record)
+            self.tfs.append(tf)
+        else:
+            self.records[pos] = record
+            self.tfs[pos] = tf
+
+    def finalize(self) -> "BM25Index":
+        postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        for i, tf in enumerate(self.tfs):
+            for term, n in tf.items():
+                postings[term].append((i, n))
+        self._postings = dict(postings)
+        self._doc_len = [sum(tf.values()) for tf in self.tfs]
+        self._avgdl = (sum(self._doc_len) / len(self._doc_len)) if self._doc_len else 0.0
+        n_docs = len(self.tfs)
+        self._idf = {
+            term: math.log(1 + (n_docs - len(p) + 0.5) / (len(p) + 0.5))
+            for term, p in self._postings.items()
+        }
+        return self
+
+    def search(self, query: str, topk: int = 10,
+               predicate: Optional[Callable[[Dict], bool]] = None) -> List[Tuple[Dict, float]]:
+        scores: Dict[int, float] = defaultdict(float)
+        for term in set(tokenize(query)):
+            idf = self._idf.get(term)
+            if idf is None:
+                continue
+            for i, tf in self._postings[term]:
+                norm = self.k1 * (1 - self.b + self.b * self._doc_len[i] / (self._avgdl or 1.0))
+                scores[i] += idf * tf * (self.k1 + 1) / (tf + norm)
+        ranked = sorted(scores.items(), key=lambda kv: -kv[1])
+        out = []
+        for i, score in ranked:
+            if predicate is None or predicate(self.records[i]):
+                out.append((self.records[i], score))
+                if len(out) >= topk:
+                    break
+        return out
+
+    def save(self, path: str) -> None:
+        writer = BM25Writer(path, k1=self.k1, b=self.b)
+        try:
+            for doc_id, record, tf in zip(self.ids, self.records, self.tfs):
+                writer.add_tf(doc_id, record, tf)
+        except BaseException:
+            writer.abort()
+            raise
+        writer.commit()
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        header, docs = _read_index_file(path)
+        index = cls(k1=header.get("k1", 1.2), b=header.get("b", 0.75))
+        for doc in docs:
+            index._add_tf(doc["id"], doc["record"], doc["tf"])
+        return index.finalize()
+
+
+# ---------- on-disk format ----------
+# JSON lines: a {"k1", "b"} header, then one {"id", "record", "tf"} per
+# document; BM25Writer leaves one line per id (a reader would let a later
+# line win anyway). Only a searcher loads the postings; a writer holds the
+# current document and the set of ids it has written.
+def _read_index_file(path: str) -> Tuple[Dict, Iterable[Dict]]:
+    f = open(path, "r", encoding="utf-8")
+    header = json.loads(f.readline() or "{}")
+
+    def docs():
+        with f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    return header, docs()
+
+
+class BM25Writer:
+    """
+    Streams documents into a new index file and publishes it atomically on
+    commit(); abort() leaves the current file untouched. With `base`,
+    commit() then copies the documents of that file that were not added
+    again (minus the ids in `skip`), so the result holds one line per id.
+    Only the set of added ids is kept in memory (one int per document).
+    """
+
+    def __init__(self, path: str, base: Optional[str] = None, skip: Iterable[int] = (),
+                 k1: float = 1.2, b: float = 0.75):
+        self.path = path
+        self.count = 0
+        self._base = base if base and os.path.exists(base) else None
+        self._skip = set(skip)
+        self._ids: set = set()
+        self._repeated = False  # an id added twice: commit() compacts
+        directory = os.path.dirname(path) or "."
+        os.makedirs(directory, exist_ok=True)
+        fd, self._tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + ".", suffix=".tmp")
+        self._f = os.fdopen(fd, "w", encoding="utf-8")
+        try:
+            if self._base:
+                with open(self._base, "r", encoding="utf-8") as f:
+                    header = json.loads(f.readline() or "{}")
+                k1, b = header.get("k1", k1), header.get("b", b)
+            self._f.write(json.dumps({"k1": k1, "b": b}) + "\n")
+        except BaseException:
+            self.abort()
+            raise
+
+    def _write(self, doc: Dict) -> None:
+        self._f.write(json.dumps(doc, ensure_ascii=False) + "\n")
+        self.count += 1
+
+    def add(self, doc_id: int, text: str, record: Dict) -> None:
+        self.add_tf(doc_id, record, dict(Counter(tokenize(text))))
+
+    def add_tf(self, doc_id: int, record: Dict, tf: Dict[str, int]) -> None:
+        if doc_id in self._ids:
+            self._repeated = True
+        self._ids.add(doc_id)
+        self._write({"id": doc_id, "record": record, "tf": tf})
+
+    def _compact(self) -> None:
+        # keep the last line of every id, in first-seen order
+        _, docs = _read_index_file(self._tmp_path)
+        last: Dict[int, int] = {}
+        for n, doc in enumerate(docs):
+            last[doc["id"]] = n
+        keep = set(last.values())
+        with open(self._tmp_path, "r", encoding="utf-8") as src, \
+                open(self._tmp_path + ".compact", "w", encoding="utf-8") as dst:
+            dst.write(src.readline())
+            self.count = 0
+            for n, line in enumerate(line for line in src if line.strip()):
+                if n in keep:
+                    dst.write(line)
+                    self.count += 1
+        os.replace(self._tmp_path + ".compact", self._tmp_path)
+
+    def commit(self) -> None:
+        try:
+            if self._base:
+                _, docs = _read_index_file(self._base)
+                for doc in docs:
+                    if doc["id"] not in self._ids and doc["id"] not in self._skip:
+                        self._write(doc)
+            self._f.close()
+            if self._repeated:
+                self._compact()
+        except BaseException:
+            self.abort()
+            raise
+        os.replace(self._tmp_path, self.path)
+
+    def abort(self) -> None:
+        self._f.close()
+        for path in (self._tmp_path, self._tmp_path + ".compact"):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def remove_documents(path: str, ids: Iterable[int]) -> None:
+    """Rewrite the index file at `path` without the documents `ids`."""
+    if not os.path.exists(path):
+        return
+    writer = BM25Writer(path, base=path, skip={int(i) for i in ids})
+    writer.commit()
+
+
+def rrf_merge(rankings: Iterable[List[Tuple[int, Dict]]], k: int = 60) -> List[Tuple[Dict, float]]:
+    """
+    Reciprocal rank fusion: each ranking is a best-first list of (id, item);
+    an item's fused score is the sum of 1 / (k + rank) over the lists it is in.
+    """
+    fused: Dict[int, float] = defaultdict(float)
+    items: Dict[int, Dict] = {}
+    for ranking in rankings:
+        for rank, (doc_id, item) in enumerate(ranking, start=1):
+            fused[doc_id] += 1.0 / (k + rank)
+            items.setdefault(doc_id, item)
+    return [(items[d], s) for d, s in sorted(fused.items(), key=lambda kv: -kv[1])]
+
+
+# ---------- process-wide handle ----------
+class LexicalIndexFile:
+    """Lazily loads a saved index and reloads it when the file changes (e.g. after ingest)."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._index: Optional[BM25Index] = None
+        self._mtime: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def get(self) -> Optional[BM25Index]:
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            return None
+        if self._index is None or mtime != self._mtime:
+            with self._lock:
+                if self._index is None or mtime != self._mtime:
+                    self._index = BM25Index.load(self.path)
+                    self._mtime = mtime
+        return self._index
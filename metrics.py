@@ -0,0 +1,226 @@
+import os
+import time
+import uuid
+import logging
+import threading
+import contextvars
+import functools
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# In-process metrics rendered in the Prometheus text format at /metrics, and
+# a per-request trace id carried through logs. No client library needed;
+# every process keeps its own numbers (scrape each worker).
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+Labels = Tuple[str, ...]
+# (metric name, type, help, [(labels, value)])
+Family = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _fmt_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+def _fmt_value(v: float) -> str:
+    return repr(float(v)) if v != float("inf") else "+Inf"
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, help: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def _key(self, labels: Dict[str, str]) -> Labels:
+        return tuple(str(labels.get(n, "")) for n in self.label_names)
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str, label_names: Sequence[str] = ()):
+        super().__init__(name, help, label_names)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_fmt_labels(dict(zip(self.label_names, k)))} {_fmt_value(v)}" for k, v in items]
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, label_names: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[Labels, List[float]] = {}  # per-bucket counts + [sum, count]
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0.0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    row[i] += 1
+            row[-2] += value
+            row[-1] += 1
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._values.items()]
+        lines = []
+        for key, row in items:
+            labels = dict(zip(self.label_names, key))
+            for bound, n in zip(self.buckets + (float("inf"),), row[:-2] + [row[-1]]):
+                lines.append(f"{self.name}_bucket{_fmt_labels({**labels, 'le': _fmt_value(bound)})} {_fmt_value(n)}")
+            lines.append(f"{self.name}_sum{_fmt_labels(labels)} {_fmt_value(row[-2])}")
+            lines.append(f"{self.name}_count{_fmt_labels(labels)} {_fmt_value(row[-1])}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], List[Family]]] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> None:
+        with self._lock:
+            self._metrics.append(metric)
+
+    def register_collector(self, fn: Callable[[], List[Family]]) -> None:
+        """fn is called at scrape time and returns metric families (e.g. cache stats)."""
+        with self._lock:
+            self._collectors.append(fn)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics, collectors = list(self._metrics), list(self._collectors)
+        lines: List[str] = []
+        for m in metrics:
+            lines += [f"# HELP {m.name} {m.help}", f"# TYPE {m.name} {m.type}", *m.render()]
+        for fn in collectors:
+            try:
+                families = fn()
+            except Exception as e:  # a broken collector must not break the scrape
+                logger.warning("metrics collector failed: %s", e)
+                continue
+            for name, type_, help_, samples in families:
+                lines += [f"# HELP {name} {help_}", f"# TYPE {name} {type_}"]
+                lines += [f"{name}{_fmt_labels(labels)} {_fmt_value(v)}" for labels, v in samples]
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+logger = logging.getLogger("tailord.metrics")
+
+
+# ---------- pipeline metrics ----------
+stage_seconds = Histogram(
+    "tailord_stage_seconds", "Latency of one pipeline stage (llm, tool, embed, vector_search, ...)",
+    ["stage", "detail"],
+)
+stage_errors = Counter("tailord_stage_errors_total", "Stages that raised or returned an error", ["stage", "detail"])
+request_seconds = Histogram("tailord_http_request_seconds", "HTTP request latency", ["method", "path", "status"])
+llm_tokens = Counter("tailord_llm_tokens_total", "Tokens reported by the LLM API", ["model", "kind"])
+
+
+@contextmanager
+def stage(name: str, detail: str = "") -> Iterator[None]:
+    """Time a block into tailord_stage_seconds{stage,detail}; exceptions are counted and re-raised."""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        stage_errors.inc(stage=name, detail=detail)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        stage_seconds.observe(elapsed, stage=name, detail=detail)
+        logger.debug("stage %s %s %.1fms", name, detail, elapsed * 1000)
+
+def record_usage(model: str, usage) -> None:
+    """Token counts from an OpenAI response's `usage` (missing on some streams)."""
+    if usage is None:
+        return
+    for kind in ("prompt_tokens", "completion_tokens"):
+        n = getattr(usage, kind, None)
+        if n:
+            llm_tokens.inc(n, model=model, kind=kind[: -len("_tokens")])
+
+_caches: Dict[str, Callable[[], Dict[str, float]]] = {}
+
+def _collect_caches() -> List[Family]:
+    stats = [({"cache": name}, fn()) for name, fn in list(_caches.items())]
+    return [
+        ("tailord_cache_hits_total", "counter", "Cache hits",
+         [(labels, s.get("hits", 0)) for labels, s in stats]),
+        ("tailord_cache_misses_total", "counter", "Cache misses",
+         [(labels, s.get("misses", 0)) for labels, s in stats]),
+        ("tailord_cache_entries", "gauge", "Entries held",
+         [(labels, s.get("size", s.get("rows", 0))) for labels, s in stats]),
+        ("tailord_cache_hit_ratio", "gauge", "Hits / lookups since process start",
+         [(labels, s.get("hit_rate", 0.0)) for labels, s in stats]),
+    ]
+
+def register_cache(name: str, stats: Callable[[], Dict[str, float]]) -> None:
+    """Expose a cache's stats() (hits, misses, size/rows, hit_rate) as tailord_cache_*{cache=name}."""
+    if not _caches:
+        REGISTRY.register_collector(_collect_caches)
+    _caches[name] = stats
+
+
+# ---------- trace ids / logging ----------
+trace_id_var: contextvars.ContextVar = contextvars.ContextVar("trace_id", default="-")
+
+def new_trace_id(given: Optional[str] = None) -> str:
+    trace_id = (given or uuid.uuid4().hex[:16])[:64]
+    trace_id_var.set(trace_id)
+    return trace_id
+
+def bind_context(fn: Callable, *args, **kwargs) -> Callable[[], object]:
+    # run_in_executor / pool.submit do not carry contextvars; this does
+    return functools.partial(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+class TraceIdFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.trace_id = trace_id_var.get()
+        return True
+
+_logging_configured = False
+
+def configure_logging(level: Optional[str] = None) -> None:
+    """Root logging with the current trace id on every line; LOG_LEVEL overrides INFO."""
+    global _logging_configured
+    if _logging_configured:
+        return
+    handler = logging.StreamHandler()
+    handler.addFilter(TraceIdFilter())
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s [%(trace_id)s] %(message)s"))
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(level or os.getenv("LOG_LEVEL", "INFO"))
+    _logging_configured = True
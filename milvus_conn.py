@@ -0,0 +1,103 @@
+import os
+import threading
+from typing import Callable, Dict, List, TypeVar
+
+# Connect once per process and keep loaded Collection handles around, so a
+# search costs one RPC instead of has_connection + Collection() + load().
+MILVUS_HOST = os.getenv("MILVUS_HOST", "127.0.0.1")
+MILVUS_PORT = os.getenv("MILVUS_PORT", "19530")
+ALIAS = "default"
+
+T = TypeVar("T")
+
+_lock = threading.Lock()
+_connected = False
+_collections: Dict[str, "Collection"] = {}
+
+
+def connect(force: bool = False) -> None:
+    global _connected
+    from pymilvus import connections
+    with _lock:
+        if force or not _connected or not connections.has_connection(ALIAS):
+            if force:
+                _collections.clear()
+                connections.disconnect(ALIAS)
+            connections.connect(alias=ALIAS, host=MILVUS_HOST, port=MILVUS_PORT)
+            _connected = True
+
+
+def get_collection(name: str):
+    """Loaded Collection handle for `name`, created and loaded once per process."""
+    col = _collections.get(name)
+    if col is not None:
+        return col
+    connect()
+    from pymilvus import Collection
+    with _lock:
+        col = _collections.get(name)
+        if col is None:
+            col = Collection(name, using=ALIAS)
+            col.load()
+            _collections[name] = col
+    return col
+
+
+def forget(name: str) -> None:
+    # drop a cached handle, e.g. after the collection was dropped/recreated
+    with _lock:
+        _collections.pop(name, None)
+
+
+# server codes that mean "not reachable right now" (Milvus merr ServiceNotReady,
+# ServiceUnavailable); anything else (bad expr, schema, missing field) is the
+# caller's error and is raised as is
+_UNAVAILABLE_CODES = {1, 2}
+
+def _is_connection_error(e: Exception) -> bool:
+    from pymilvus.exceptions import (
+        ConnectError, ConnectionNotExistException, MilvusException, MilvusUnavailableException,
+    )
+    if isinstance(e, (ConnectionError, ConnectError, ConnectionNotExistException, MilvusUnavailableException)):
+        return True
+    if isinstance(e, MilvusException):
+        return getattr(e, "code", None) in _UNAVAILABLE_CODES
+    try:
+        import grpc
+    except ImportError:
+        return False
+    return isinstance(e, grpc.RpcError) and e.code() == grpc.StatusCode.UNAVAILABLE
+
+
+def run(name: str, fn: Callable[["Collection"], T]) -> T:
+    """
+    Call fn(collection) on the cached handle. On a connection-level failure
+    reconnect, reload the handle and retry once; other errors propagate
+    unchanged and leave the connection and handles alone.
+    """
+    try:
+        return fn(get_collection(name))
+    except Exception as e:
+        if not _is_connection_error(e):
+            raise
+        connect(force=True)
+        return fn(get_collection(name))
+
+
+def loaded_collections() -> List[str]:
+    return sorted(_collections)
+
+
+def close() -> None:
+    """
+    Drop cached handles and disconnect; called on API shutdown. Collections
+    are not released server-side since other workers may still be serving
+    from them.
+    """
+    global _connected
+    with _lock:
+        _collections.clear()
+        if _connected:
+            from pymilvus import connections
+            connections.disconnect(ALIAS)
+            _connected = False
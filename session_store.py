@@ -0,0 +1,90 @@
+from __future__ import annotations
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, Optional
+
+import asyncio
+import time
+import uuid
+
+
+# ---------- per-conversation state ----------
+@dataclass
+class Session:
+    session_id: str
+    messages: Deque[Dict[str, Any]]
+    ctx: Dict[str, Any]
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    last_used: float = field(default_factory=time.monotonic)
+
+    def touch(self) -> None:
+        self.last_used = time.monotonic()
+
+
+class SessionStore:
+    """
+    Session-keyed conversation store. Each session owns its own history, ctx
+    and lock, so independent conversations never wait on each other.
+
+    Memory is bounded two ways: sessions idle for longer than `ttl_seconds`
+    are dropped, and once more than `max_sessions` exist the least recently
+    used ones are evicted. Sessions with a turn in flight (lock held) are
+    never evicted.
+
+    All bookkeeping happens on the event loop thread without awaiting, so the
+    OrderedDict needs no lock of its own.
+    """
+
+    def __init__(
+        self,
+        max_turns: int = 60,
+        max_sessions: int = 1000,
+        ttl_seconds: float = 60 * 60,
+        default_ctx: Optional[Dict[str, Any]] = None,
+    ):
+        self.max_turns = max_turns
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.default_ctx = dict(default_ctx or {})
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def get_or_create(self, session_id: Optional[str] = None) -> Session:
+        self._evict_expired()
+
+        sid = session_id or uuid.uuid4().hex
+        session = self._sessions.get(sid)
+        if session is None:
+            session = Session(
+                session_id=sid,
+                messages=deque(maxlen=self.max_turns),
+                ctx=dict(self.default_ctx),
+            )
+            self._sessions[sid] = session
+            self._evict_overflow(keep=sid)
+        else:
+            self._sessions.move_to_end(sid)
+        session.touch()
+        return session
+
+    def drop(self, session_id: str) -> None:
+        self._sessions.pop(session_id, None)
+
+    def _evict_expired(self) -> None:
+        # OrderedDict is kept in LRU order, so stale sessions sit at the front
+        cutoff = time.monotonic() - self.ttl_seconds
+        for sid in list(self._sessions):
+            session = self._sessions[sid]
+            if session.last_used >= cutoff:
+                break
+            if not session.lock.locked():
+                del self._sessions[sid]
+
+    def _evict_overflow(self, keep: str) -> None:
+        for sid in list(self._sessions):
+            if len(self._sessions) <= self.max_sessions:
+                break
+            if sid != keep and not self._sessions[sid].lock.locked():
+                del self._sessions[sid]
@@ -0,0 +1,105 @@
+"""
+run_agent_turn_async against a local fake chat-completions client: N turns
+gathered on one event loop take about as long as one turn.
+"""
+import asyncio
+import time
+from types import SimpleNamespace
+
+import agent
+
+LLM_SECONDS = 0.2
+TOOL_SECONDS = 0.2
+TURNS = 8
+
+
+class _ToolCall(SimpleNamespace):
+    def model_dump(self):
+        return {"id": self.id, "type": "function",
+                "function": {"name": self.function.name, "arguments": self.function.arguments}}
+
+
+class FakeCompletions:
+    """First call of a turn asks for one tool; once a tool result is in the transcript, answers."""
+
+    async def create(self, *, messages, **kwargs):
+        await asyncio.sleep(LLM_SECONDS)
+        if messages[-1]["role"] == "tool":
+            msg = SimpleNamespace(content=f"done: {messages[-1]['content']}", tool_calls=None)
+        else:
+            call = _ToolCall(id="call_1", function=SimpleNamespace(name="slow_tool", arguments='{"x": 1}'))
+            msg = SimpleNamespace(content=None, tool_calls=[call])
+        return SimpleNamespace(choices=[SimpleNamespace(message=msg)], usage=None)
+
+
+def fake_client():
+    return SimpleNamespace(chat=SimpleNamespace(completions=FakeCompletions()))
+
+
+def slow_tool(x):
+    time.sleep(TOOL_SECONDS)  # blocking, like encode / vector search
+    return {"x": x}
+
+
+def _turn():
+    return agent.run_agent_turn_async(
+        [{"role": "user", "content": "black cargo pants"}], "system", {}, llm_client=fake_client(),
+    )
+
+
+def test_concurrent_turns_take_about_one_turn(monkeypatch):
+    monkeypatch.setitem(agent.DISPATCH, "slow_tool", slow_tool)
+    assert TURNS <= agent.TOOL_WORKERS
+
+    async def main():
+        t0 = time.perf_counter()
+        assert await _turn() == 'done: {"x": 1}'
+        one = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        replies = await asyncio.gather(*(_turn() for _ in range(TURNS)))
+        many = time.perf_counter() - t0
+        return one, many, replies
+
+    one, many, replies = asyncio.run(main())
+    assert replies == ['done: {"x": 1}'] * TURNS
+    assert one >= 2 * LLM_SECONDS + TOOL_SECONDS
+    # serialized turns would take TURNS * one
+    assert many < 1.5 * one
+
+
+class FakeStreamCompletions:
+    """Streams a preamble plus a tool call, then the answer once the tool result is in."""
+
+    async def create(self, *, messages, **kwargs):
+        if messages[-1]["role"] == "tool":
+            chunks = [self._delta(content="Here "), self._delta(content="you go.")]
+        else:
+            call = SimpleNamespace(index=0, id="call_1",
+                                   function=SimpleNamespace(name="slow_tool", arguments='{"x": 2}'))
+            chunks = [self._delta(content="Let me check."), self._delta(tool_calls=[call])]
+
+        async def gen():
+            for c in chunks:
+                yield c
+        return gen()
+
+    @staticmethod
+    def _delta(content=None, tool_calls=None):
+        delta = SimpleNamespace(content=content, tool_calls=tool_calls)
+        return SimpleNamespace(choices=[SimpleNamespace(delta=delta)], usage=None)
+
+
+def test_stream_done_reply_matches_streamed_tokens(monkeypatch):
+    monkeypatch.setitem(agent.DISPATCH, "slow_tool", lambda x: {"x": x})
+    client = SimpleNamespace(chat=SimpleNamespace(completions=FakeStreamCompletions()))
+
+    async def main():
+        return [ev async for ev in agent.stream_agent_turn(
+            [{"role": "user", "content": "tees"}], "system", {}, llm_client=client)]
+
+    events = asyncio.run(main())
+    tokens = "".join(ev["text"] for ev in events if ev["type"] == "token")
+    assert [ev["type"] for ev in events].count("progress") == 1
+    assert events[-1] == {"type": "done", "reply": tokens}
+    assert tokens == "Let me check.\n\nHere you go."
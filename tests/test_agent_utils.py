@@ -0,0 +1,15 @@
+import pytest
+
+from agent_utils import split_filters
+from db_upload import _filters_key
+
+
+@pytest.mark.parametrize("sizes, expected", [
+    (30, ["30"]), ("M", ["M"]), (["M", 30], ["M", "30"]), ([None, "", "S"], ["S"]), (None, None), ([], None),
+])
+def test_split_filters_stringifies_llm_sizes(sizes, expected):
+    rest, filters = split_filters({"item": "Jeans", "sizes": sizes})
+    assert "sizes" not in rest
+    assert filters.get("sizes") == expected
+    _filters_key({"only_in_stock": True, **filters})
+    _filters_key({"sizes": ["M", 30]})
@@ -0,0 +1,35 @@
+import pytest
+
+from facet_extractor import extract_facets
+
+
+@pytest.mark.parametrize("query", ["jeans size 28-30", "black jeans from 2000s", "y2k jeans from 2003",
+                                   "jeans 50-100", "tees 30+"])
+def test_numbers_without_a_price_cue_are_not_prices(query):
+    out, _ = extract_facets(query)
+    assert "price" not in out
+
+
+def test_size_range_is_not_a_price():
+    out, confidence = extract_facets("jeans size 28-30")
+    assert out["sizes"] == ["28", "29", "30"]
+    assert confidence == 1.0
+
+
+@pytest.mark.parametrize("query, price", [
+    ("black cargo pants under 50", "under 50"),
+    ("hoodie $50-100", "$50-100"),
+    ("tees $30+", "$30+"),
+    ("cargo pants from $20", "from $20"),
+    ("dress between 20 and 60", "between 20 and 60"),
+])
+def test_cued_prices(query, price):
+    out, confidence = extract_facets(query)
+    assert out["price"] == price
+    assert confidence == 1.0
+
+
+def test_uncued_lower_bound_needs_the_llm():
+    out, confidence = extract_facets("jeans over 40")
+    assert out["price"] == "over 40"
+    assert confidence < 0.8
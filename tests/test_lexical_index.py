@@ -0,0 +1,37 @@
+from lexical_index import BM25Index, BM25Writer, remove_documents
+
+
+def _lines(path):
+    with open(path, encoding="utf-8") as f:
+        return sum(1 for line in f if line.strip()) - 1  # minus the header
+
+
+def _write(path, ids, base=None, tag=""):
+    writer = BM25Writer(path, base=base)
+    for i in ids:
+        writer.add(i, f"black cargo pants {tag}", {"id": i, "tag": tag})
+    writer.commit()
+
+
+def test_repeated_merges_keep_one_line_per_id(tmp_path):
+    path = str(tmp_path / "bm25.jsonl")
+    _write(path, range(10))
+    for run in range(3):
+        _write(path, range(5), base=path, tag=f"run{run}")
+        assert _lines(path) == 10
+    index = BM25Index.load(path)
+    assert len(index) == 10
+    assert {r["tag"] for r in index.records} == {"", "run2"}
+
+
+def test_repeated_ids_in_one_run_are_compacted(tmp_path):
+    path = str(tmp_path / "bm25.jsonl")
+    _write(path, [1, 2, 1, 3, 1])
+    assert _lines(path) == 3
+
+
+def test_remove_documents(tmp_path):
+    path = str(tmp_path / "bm25.jsonl")
+    _write(path, range(4))
+    remove_documents(path, [1, 3])
+    assert sorted(BM25Index.load(path).ids) == [0, 2]